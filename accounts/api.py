@@ -0,0 +1,31 @@
+"""閲覧者と複数のユーザーとのフォロー関係のJSON API"""
+
+from django.http import JsonResponse
+
+from tweets.api import JsonApiView
+
+from .relationships import get_relationships
+
+
+class RelationshipApiView(JsonApiView):
+    """?ids=1,2,3のユーザーそれぞれについて、閲覧者がフォローしているか・フォローされているかを返す"""
+
+    max_ids = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.user_ids = [int(pk) for pk in request.GET.get("ids", "").split(",") if pk]
+        except ValueError:
+            return JsonResponse({"error": "idsはユーザーのidをカンマで区切って指定してください"}, status=400)
+        if len(self.user_ids) > self.max_ids:
+            return JsonResponse({"error": "idsは{}件までです".format(self.max_ids)}, status=400)
+        return super().get(request, *args, **kwargs)
+
+    def get_data(self):
+        found = get_relationships(self.request.user, self.user_ids)
+        return {
+            "relationships": {
+                str(pk): {**relationship._asdict(), "mutual": relationship.mutual}
+                for pk, relationship in sorted(found.items())
+            }
+        }
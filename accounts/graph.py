@@ -0,0 +1,60 @@
+"""おすすめユーザーの計算に使うフォローのグラフ
+
+Djangoのモデルをimportしないので、multiprocessingの子プロセスでもDjangoを設定せずに読み込める。
+"""
+
+import heapq
+from array import array
+from collections import Counter
+
+
+class FollowGraph:
+    """フォロー先のidを、フォローする側のidの順に並べた整数の配列(CSR形式)
+
+    ユーザーuのフォロー先はindices[indptr[u]:indptr[u + 1]]。ユーザーのidを添字にするので、
+    モデルのインスタンスやdictを作らず、ユーザー1人とフォロー1件がそれぞれ8バイトで済む。
+    """
+
+    def __init__(self, edges):
+        """フォローする側のidの順に並んだ(follower_id, following_id)から作る"""
+        self.indptr = array("q", [0])
+        self.indices = array("q")
+        for follower_id, following_id in edges:
+            if follower_id < len(self.indptr) - 1:
+                raise ValueError("edgesはfollower_idの順に並べてください")
+            while len(self.indptr) <= follower_id:
+                self.indptr.append(len(self.indices))
+            self.indices.append(following_id)
+        self.indptr.append(len(self.indices))
+
+    def following(self, user_id):
+        if user_id + 1 >= len(self.indptr):
+            return self.indices[0:0]
+        return self.indices[self.indptr[user_id] : self.indptr[user_id + 1]]
+
+    def recommend(self, user_id, limit):
+        """user_idのフォローがフォローしているユーザーを、共通のフォロー数の多い順(同じならidの小さい順)に
+        [(user_id, 共通のフォロー数), ...]でlimit件返す。自分とフォロー済みのユーザーは除く
+        """
+        followed = self.following(user_id)
+        counts = Counter()
+        for followee in followed:
+            counts.update(self.following(followee))
+        excluded = set(followed)
+        excluded.add(user_id)
+        candidates = ((pk, mutual) for pk, mutual in counts.items() if pk not in excluded)
+        return heapq.nlargest(limit, candidates, key=lambda candidate: (candidate[1], -candidate[0]))
+
+
+# プロセスプールの子プロセスごとのグラフ。init_workerで親プロセスから受け取る
+_graph = None
+_limit = None
+
+
+def init_worker(graph, limit):
+    global _graph, _limit
+    _graph, _limit = graph, limit
+
+
+def recommend_batch(user_ids):
+    return [(user_id, _graph.recommend(user_id, _limit)) for user_id in user_ids]
@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.models import Friendship
+from tweets import versions
+from tweets.management.reconcile import ReconcileCommand
+
+User = get_user_model()
+
+
+def count_by(field):
+    """Friendshipのfield側がそのユーザーである件数を数えるサブクエリ"""
+    edges = Friendship.objects.filter(**{field: OuterRef("pk")}).values(field).annotate(n=Count("pk")).values("n")
+    return Coalesce(Subquery(edges), 0)
+
+
+class Command(ReconcileCommand):
+    help = "User.follower_count/following_countをFriendshipテーブルの実際の件数に合わせて修正する"
+    drifted_message = "{}人のフォロー数・フォロワー数がずれています"
+    fixed_message = "{}人のフォロー数・フォロワー数を修正しました"
+
+    def get_drifted_ids(self, options):
+        return (
+            User.objects.annotate(actual_follower=count_by("following"), actual_following=count_by("follower"))
+            .filter(~Q(follower_count=F("actual_follower")) | ~Q(following_count=F("actual_following")))
+            .values_list("pk", flat=True)
+        )
+
+    def fix(self, ids):
+        User.objects.filter(pk__in=ids).update(
+            follower_count=count_by("following"), following_count=count_by("follower")
+        )
+        versions.bump("friends", *ids)
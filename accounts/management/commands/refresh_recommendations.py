@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import recommendations
+
+
+class Command(BaseCommand):
+    help = "全ユーザーのおすすめユーザー(友達の友達)を計算して保存する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, help="計算に使うプロセス数(省略するとCPUの数)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="1つのプロセスにまとめて渡すユーザー数")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="指定すると終了せず、この秒数ごとに計算し続ける(RECOMMENDATION_TTLより短くする)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            count = recommendations.refresh(options["processes"], options["batch_size"])
+            self.stdout.write(
+                self.style.SUCCESS("{}人のおすすめを{:.1f}秒で計算しました".format(count, time.perf_counter() - start))
+            )
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
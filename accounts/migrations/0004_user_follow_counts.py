@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    Friendship = apps.get_model("accounts", "Friendship")
+
+    def count_by(field):
+        edges = Friendship.objects.filter(**{field: OuterRef("pk")}).values(field).annotate(n=Count("pk"))
+        return Coalesce(Subquery(edges.values("n")), 0)
+
+    User.objects.update(follower_count=count_by("following"), following_count=count_by("follower"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_auto_20230316_1433"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="follower_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:11
+
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def dedupe_friendships(apps, schema_editor):
+    """unique_friendshipを追加する前に、重複したフォローを一番古いもの以外削除する"""
+    User = apps.get_model("accounts", "User")
+    Friendship = apps.get_model("accounts", "Friendship")
+    duplicates = (
+        Friendship.objects.values("follower", "following")
+        .annotate(keep=Min("pk"), n=Count("pk"))
+        .filter(n__gt=1)
+        .values_list("follower", "following", "keep")
+    )
+    affected = set()
+    for follower, following, keep in list(duplicates):
+        Friendship.objects.filter(follower=follower, following=following).exclude(pk=keep).delete()
+        affected.update((follower, following))
+    if not affected:
+        return
+
+    def count_by(field):
+        edges = Friendship.objects.filter(**{field: OuterRef("pk")}).values(field).annotate(n=Count("pk"))
+        return Coalesce(Subquery(edges.values("n")), 0)
+
+    User.objects.filter(pk__in=affected).update(
+        follower_count=count_by("following"), following_count=count_by("follower")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_user_follow_counts"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_friendships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_dedupe_friendships"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["follower", "created_time_date", "id"], name="friendship_follower_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["following", "created_time_date", "id"], name="friendship_following_time_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="friendship",
+            constraint=models.UniqueConstraint(fields=("follower", "following"), name="unique_friendship"),
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.db import models
 
 class User(AbstractUser):
     email = models.EmailField()
+    follower_count = models.PositiveIntegerField(default=0)  # FollowView/UnFollowViewで増減させる非正規化カラム
+    following_count = models.PositiveIntegerField(default=0)
 
 
 class Friendship(models.Model):
@@ -11,5 +13,23 @@ class Friendship(models.Model):
     follower = models.ForeignKey(User, related_name="following", on_delete=models.CASCADE)
     created_time_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["follower", "following"], name="unique_friendship")]
+        indexes = [
+            models.Index(fields=["follower", "created_time_date", "id"], name="friendship_follower_time_idx"),
+            models.Index(fields=["following", "created_time_date", "id"], name="friendship_following_time_idx"),
+        ]
+
     def __str__(self):
         return "{} : {}".format(self.follower.username, self.following.username)
+
+
+class UserRecommendation(models.Model):
+    """ユーザーごとのおすすめユーザー(accounts/recommendations.py)
+
+    manage.py refresh_recommendationsと表示時の計算が書き込み、computed_atからRECOMMENDATION_TTL秒使う。
+    """
+
+    user = models.OneToOneField(User, primary_key=True, related_name="recommendation", on_delete=models.CASCADE)
+    candidates = models.JSONField(default=list)  # [[user_id, 共通のフォロー数], ...]
+    computed_at = models.DateTimeField()
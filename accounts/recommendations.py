@@ -0,0 +1,118 @@
+"""おすすめユーザー(友達の友達)
+
+ユーザーへのおすすめは、フォローしているユーザーがフォローしているユーザーのうち、自分とフォロー済みのユーザーを
+除いたもので、自分のフォローのうち何人がそのユーザーをフォローしているか(共通のフォロー数)の多い順に並べる。
+
+全ユーザー分はmanage.py refresh_recommendationsで計算する。ユーザーごとにORMで集計すると
+同じフォローのフォローを何度も読み込むので、Friendshipを一度だけ整数の配列(graph.py)に読み込み、
+ユーザーをbatch_size人ずつプロセスプールで計算する。結果はプロセス間で共有できるようUserRecommendationに保存し、
+RECOMMENDATION_TTL秒使う。保存していないか古いユーザーは表示する時にそのユーザーの分だけDBで集計して保存し、
+フォロー・フォロー解除したら削除する。
+"""
+
+import multiprocessing
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+from django.utils import timezone
+
+from .graph import FollowGraph, init_worker, recommend_batch
+from .models import Friendship, UserRecommendation
+
+User = get_user_model()
+
+BATCH_SIZE = 10000
+
+
+def load_graph(batch_size=BATCH_SIZE):
+    """Friendship全体をbatch_size件ずつ読み込んでFollowGraphにする(unique_friendshipのインデックスの順)"""
+    edges = Friendship.objects.order_by("follower_id", "following_id").values_list("follower_id", "following_id")
+    return FollowGraph(edges.iterator(chunk_size=batch_size))
+
+
+def compute(user_id, limit=None):
+    """1ユーザー分のおすすめを、FollowGraph.recommendと同じ[(user_id, 共通のフォロー数), ...]でDBで集計する"""
+    followed = Friendship.objects.filter(follower_id=user_id).values("following_id")
+    candidates = (
+        Friendship.objects.filter(follower_id__in=followed)
+        .exclude(following_id=user_id)
+        .exclude(following_id__in=followed)
+        .values("following_id")
+        .annotate(mutual=Count("pk"))
+        .order_by("-mutual", "following_id")
+        .values_list("following_id", "mutual")
+    )
+    return list(candidates[: limit or settings.RECOMMENDATION_LIMIT])
+
+
+def store(results, computed_at=None):
+    """[(user_id, おすすめ), ...]を保存する(保存済みのユーザーは置き換える)"""
+    computed_at = computed_at or timezone.now()
+    UserRecommendation.objects.bulk_create(
+        [UserRecommendation(user_id=user_id, candidates=found, computed_at=computed_at) for user_id, found in results],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["candidates", "computed_at"],
+    )
+
+
+def refresh_user(user_id):
+    """1ユーザー分のおすすめをDBで集計し直して保存し、計算した日時を返す"""
+    computed_at = timezone.now()
+    store([(user_id, compute(user_id))], computed_at)
+    return computed_at
+
+
+def invalidate(*user_ids):
+    UserRecommendation.objects.filter(user_id__in=user_ids).delete()
+
+
+def is_fresh(computed_at):
+    """computed_atに計算したおすすめがまだRECOMMENDATION_TTL秒以内かどうか"""
+    return computed_at is not None and computed_at > timezone.now() - timedelta(seconds=settings.RECOMMENDATION_TTL)
+
+
+def get_recommendations(user):
+    """userへのおすすめのユーザーを、共通のフォロー数(mutual_follow_count)を付けて返す
+
+    select_related("recommendation")で取得したuserなら、保存済みのおすすめを読むクエリは実行しない。
+    """
+    try:
+        row = user.recommendation
+    except UserRecommendation.DoesNotExist:
+        row = None
+    if row is not None and is_fresh(row.computed_at):
+        found = row.candidates
+    else:
+        found = compute(user.pk)
+        store([(user.pk, found)])
+    users = User.objects.only("username").in_bulk([pk for pk, _ in found])
+    recommended = []
+    for pk, mutual in found:
+        if pk in users:  # 保存した後に削除されたユーザーは除く
+            users[pk].mutual_follow_count = mutual
+            recommended.append(users[pk])
+    return recommended
+
+
+def refresh(processes=None, batch_size=1000):
+    """全ユーザーのおすすめを計算して保存し、ユーザー数を返す
+
+    processesが1ならこのプロセスで計算する。子プロセスはグラフだけを使い、DBには接続しない。
+    """
+    computed_at = timezone.now()
+    graph = load_graph()
+    limit = settings.RECOMMENDATION_LIMIT
+    user_ids = array("q", User.objects.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=BATCH_SIZE))
+    batches = (user_ids[start : start + batch_size] for start in range(0, len(user_ids), batch_size))
+    if processes == 1:
+        for batch in batches:
+            store([(user_id, graph.recommend(user_id, limit)) for user_id in batch], computed_at)
+    else:
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(graph, limit)) as pool:
+            for results in pool.imap_unordered(recommend_batch, batches):
+                store(results, computed_at)
+    return len(user_ids)
@@ -0,0 +1,45 @@
+"""閲覧者と複数のユーザーとのフォロー関係の一括取得
+
+フォロワー一覧やツイートの一覧でフォローボタンを出すのに、行ごとにFriendshipを確認するとN+1になるので、
+表示するユーザーのidをまとめて1回のクエリで取得する。
+"""
+
+from typing import NamedTuple
+
+from django.db.models import Q
+
+from .models import Friendship
+
+
+class Relationship(NamedTuple):
+    following: bool = False  # 閲覧者がフォローしている
+    followed_by: bool = False  # 閲覧者をフォローしている
+
+    @property
+    def mutual(self):
+        return self.following and self.followed_by
+
+
+def get_relationships(viewer, user_ids):
+    """{user_id: Relationship}をuser_idsの全員分、1回のクエリで返す(未ログインならクエリを実行しない)"""
+    user_ids = set(user_ids)
+    following, followed_by = set(), set()
+    if viewer.is_authenticated and user_ids:
+        edges = Friendship.objects.filter(
+            Q(follower=viewer, following_id__in=user_ids) | Q(following=viewer, follower_id__in=user_ids)
+        ).values_list("follower_id", "following_id")
+        for follower_id, following_id in edges:
+            if follower_id == viewer.pk:
+                following.add(following_id)
+            if following_id == viewer.pk:
+                followed_by.add(follower_id)
+    return {pk: Relationship(pk in following, pk in followed_by) for pk in user_ids}
+
+
+def attach_relationships(viewer, objects, get_user_id):
+    """objectsのそれぞれに、get_user_id(object)のユーザーとのRelationshipをrelationshipとして付ける"""
+    objects = list(objects)
+    found = get_relationships(viewer, (get_user_id(obj) for obj in objects))
+    for obj in objects:
+        obj.relationship = found[get_user_id(obj)]
+    return objects
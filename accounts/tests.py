@@ -1,18 +1,38 @@
+import re
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY, get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 
 # from django.contrib.messages import get_messages
-from django.test import TestCase
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from tweets.models import Tweet
 
-from .models import Friendship
+from . import recommendations
+from .graph import FollowGraph
+from .models import Friendship, UserRecommendation
+from .relationships import Relationship, attach_relationships, get_relationships
+from .views import UserProfileView
 
 User = get_user_model()
 
 
+def page_words(html):
+    """空白とCSRFトークン(描画のたびに変わる)を除いたページの内容"""
+    return re.sub(r'name="csrfmiddlewaretoken" value="[^"]*"', "", html).split()
+
+
 class TestSignupView(TestCase):
     def setUp(self):
         self.url = reverse("accounts:signup")
@@ -276,7 +296,7 @@ class TestUserProfileView(TestCase):
         self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
         self.client.login(username="testuser1", password="testpassword")
         self.objects = Tweet.objects.create(user=self.user1, content="test")
-        Friendship.objects.create(following=self.user2, follower=self.user1)
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
         response = self.client.get(reverse("accounts:profile", kwargs={"username": self.user1.username}))
         tweets = response.context["tweet_list"]
         self.assertEqual(tweets.count(), Tweet.objects.all().count())  # レコード数が一致するかどうか
@@ -292,6 +312,126 @@ class TestUserProfileView(TestCase):
         )
 
 
+class TestUserProfileStreaming(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser1", password="testpassword")
+        Tweet.objects.bulk_create(Tweet(user=self.user, content="tweet{}".format(i)) for i in range(5))
+        self.client.login(username="testuser1", password="testpassword")
+        self.async_client.force_login(self.user)
+        self.url = reverse("accounts:profile", kwargs={"username": self.user.username})
+
+    def test_same_as_template_response(self):
+        rendered = self.client.get(self.url).content.decode()
+        response = self.client.get(self.url, {"stream": "1"})
+        self.assertTrue(response.streaming)
+        self.assertEqual(page_words(b"".join(response.streaming_content).decode()), page_words(rendered))
+
+    @override_settings(STREAM_TWEET_LISTS=True)
+    def test_stream_in_chunks(self):
+        with patch.object(UserProfileView, "stream_chunk_size", 2):
+            response = self.client.get(self.url)
+            chunks = list(response.streaming_content)
+        # ページの先頭、2件ずつのツイート3回分、ページの残り
+        self.assertEqual(len(chunks), 5)
+        self.assertIn("testuser1のProfile", chunks[0].decode())
+        self.assertNotIn("tweet0", chunks[0].decode())
+        self.assertFalse(self.client.get(self.url, {"stream": "0"}).streaming)
+
+    async def test_not_streaming_under_asgi(self):
+        # Django 4.1のASGIハンドラーはイベントループの中でレスポンスを読むので、ORMを使うストリーミングはしない
+        response = await self.async_client.get(self.url, {"stream": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertContains(response, "tweet4")
+
+
+class TestUserProfileConditionalGet(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user2, content="test")
+        self.client.login(username="testuser1", password="testpassword")
+        self.url = reverse("accounts:profile", kwargs={"username": self.user2.username})
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified_by_follow(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["is_following"])
+
+    def test_modified_by_tweet(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.client.login(username="testuser2", password="testpassword")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:create"), {"content": "new tweet"})
+        self.client.login(username="testuser1", password="testpassword")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "new tweet")
+
+    def test_modified_by_login_again(self):
+        client = Client(enforce_csrf_checks=True)
+
+        def login():
+            token = client.get(reverse("accounts:login")).context["csrf_token"]
+            data = {"username": "testuser1", "password": "testpassword", "csrfmiddlewaretoken": token}
+            self.assertEqual(client.post(reverse("accounts:login"), data).status_code, 302)
+
+        login()
+        response = client.get(self.url)
+        etag = response["ETag"]
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        client.post(reverse("accounts:logout"), {"csrfmiddlewaretoken": response.context["csrf_token"]})
+        login()
+        # ログインし直すとCSRFトークンが変わるので、古いトークンの入ったページに304を返さない
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        follow_url = reverse("accounts:follow", kwargs={"username": self.user2.username})
+        response = client.post(follow_url, {"csrfmiddlewaretoken": response.context["csrf_token"]})
+        self.assertEqual(response.status_code, 302)
+
+    def test_modified_by_delete(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.client.login(username="testuser2", password="testpassword")
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(len(callbacks), 1)  # バージョンの更新は削除のコミット後
+        self.client.login(username="testuser1", password="testpassword")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["stats"].tweet_count, 0)
+
+    def test_modified_by_like_from_other_user(self):
+        etag = self.client.get(self.url)["ETag"]
+        user3 = User.objects.create_user(username="testuser3", password="testpassword")
+        self.client.force_login(user3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.client.login(username="testuser1", password="testpassword")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<span class="count_{}">1</span>'.format(self.tweet.pk), html=True)
+
+    def test_pending_messages_are_rendered(self):
+        etag = self.client.get(self.url)["ETag"]
+        # すでにフォローしている場合はバージョンが変わらないが、警告のメッセージを表示するため304にしない
+        Friendship.objects.create(follower=self.user1, following=self.user2)
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(get_messages(response.wsgi_request)), 1)
+
+
 class TestUserProfileEditView(TestCase):
     def test_success_get(self):
         pass
@@ -321,6 +461,10 @@ class TestFollowView(TestCase):
             target_status_code=200,
         )
         self.assertTrue(Friendship.objects.filter(follower=self.user1, following=self.user2).exists())
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 1)
+        self.assertEqual(self.user2.follower_count, 1)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:follow", kwargs={"username": "empty.user"}))
@@ -341,6 +485,13 @@ class TestFollowView(TestCase):
         message = str(messages[0])
         self.assertEqual(message, f"あなたはすでに{self.user2.username}をフォローしています")  # フォーマットのやり方が悪かった、Hasegawaさんのコード参照
 
+    def test_post_twice_creates_one_friendship(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.assertEqual(Friendship.objects.filter(follower=self.user1, following=self.user2).count(), 1)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.follower_count, 1)
+
 
 class TestUnfollowView(TestCase):
     def setUp(self):
@@ -359,6 +510,15 @@ class TestUnfollowView(TestCase):
         )
         self.assertFalse(Friendship.objects.filter(follower=self.user2, following=self.user1).exists())
 
+    def test_counts_are_decremented(self):
+        User.objects.filter(pk=self.user1.pk).update(following_count=1)
+        User.objects.filter(pk=self.user2.pk).update(follower_count=1)
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user2.username}))
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 0)
+        self.assertEqual(self.user2.follower_count, 0)
+
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "not_exist_user.username"}))
         self.assertEqual(response.status_code, 404)
@@ -384,3 +544,229 @@ class TestFollowerListView(TestCase):
         self.client.login(username="testuser", password="testpassword")
         response = self.client.get(reverse("accounts:follower_list", kwargs={"username": self.user.username}))
         self.assertEqual(response.status_code, 200)
+
+    def test_success_get_with_cursor(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        followers = User.objects.bulk_create([User(username="follower{}".format(i)) for i in range(25)])
+        for follower in followers:
+            Friendship.objects.create(follower=follower, following=self.user)
+        newest_first = list(Friendship.objects.filter(following=self.user).order_by("-created_time_date", "-id"))
+        url = reverse("accounts:follower_list", kwargs={"username": self.user.username})
+
+        response = self.client.get(url)
+        self.assertEqual(response.context["follower_list"], newest_first[:20])
+        response = self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(response.context["follower_list"], newest_first[20:])
+        self.assertFalse(response.context["page_obj"].has_next())
+
+    def test_failure_get_with_not_exist_user(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "not_exist_user"}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestRecommendations(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = User.objects.bulk_create([User(username="user{}".format(i)) for i in range(6)])
+        self.user = self.users[0]
+        self.user.set_password("testpassword")
+        self.user.save()
+        # user0 -> user1, user2, user3
+        # user1 -> user4, user5, user0 / user2 -> user4, user3 / user3 -> user5
+        edges = [(0, 1), (0, 2), (0, 3), (1, 4), (1, 5), (1, 0), (2, 4), (2, 3), (3, 5)]
+        Friendship.objects.bulk_create(Friendship(follower=self.users[a], following=self.users[b]) for a, b in edges)
+        self.expected = [(self.users[4].pk, 2), (self.users[5].pk, 2)]
+
+    def test_graph(self):
+        graph = recommendations.load_graph(batch_size=2)
+        self.assertEqual(list(graph.following(self.users[2].pk)), [self.users[3].pk, self.users[4].pk])
+        self.assertEqual(list(graph.following(self.users[5].pk)), [])
+        self.assertEqual(list(graph.following(self.users[5].pk + 100)), [])
+        # 自分とフォロー済みのユーザー(user0, user3)を除き、共通のフォロー数・idの順
+        self.assertEqual(graph.recommend(self.user.pk, 5), self.expected)
+        self.assertEqual(graph.recommend(self.user.pk, 1), self.expected[:1])
+        self.assertEqual(graph.recommend(self.users[2].pk, 5), [(self.users[5].pk, 1)])
+
+    def test_graph_requires_sorted_edges(self):
+        with self.assertRaises(ValueError):
+            FollowGraph([(2, 1), (1, 2)])
+
+    def test_compute_matches_graph(self):
+        graph = recommendations.load_graph()
+        for user in self.users:
+            self.assertEqual(recommendations.compute(user.pk), graph.recommend(user.pk, settings.RECOMMENDATION_LIMIT))
+
+    def test_refresh_command(self):
+        for processes in ("1", "2"):
+            UserRecommendation.objects.all().delete()
+            out = StringIO()
+            call_command("refresh_recommendations", "--processes", processes, "--batch-size", "2", stdout=out)
+            self.assertIn("6人", out.getvalue())
+            candidates = dict(UserRecommendation.objects.values_list("user_id", "candidates"))
+            self.assertEqual(len(candidates), 6)
+            self.assertEqual(candidates[self.user.pk], [list(candidate) for candidate in self.expected])
+            self.assertEqual(candidates[self.users[5].pk], [])
+
+    def test_profile_uses_stored(self):
+        self.client.login(username=self.user.username, password="testpassword")
+        url = reverse("accounts:profile", kwargs={"username": self.user.username})
+        response = self.client.get(url)
+        self.assertEqual(
+            [(user.username, user.mutual_follow_count) for user in response.context["recommendations"]],
+            [("user4", 2), ("user5", 2)],
+        )
+        self.assertContains(response, "共通のフォロー2人")
+        # 保存済みで古くなければ集計しない
+        recommendations.store([(self.user.pk, [(self.users[5].pk, 9)])])
+        response = self.client.get(url)
+        self.assertEqual([user.username for user in response.context["recommendations"]], ["user5"])
+        # RECOMMENDATION_TTLを過ぎたら集計し直す
+        recommendations.store(
+            [(self.user.pk, [])], timezone.now() - timedelta(seconds=settings.RECOMMENDATION_TTL + 1)
+        )
+        response = self.client.get(url)
+        self.assertEqual([user.username for user in response.context["recommendations"]], ["user4", "user5"])
+
+    def test_refresh_changes_etag(self):
+        self.client.login(username=self.user.username, password="testpassword")
+        url = reverse("accounts:profile", kwargs={"username": self.user.username})
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # 別のプロセス(refresh_recommendations)で計算し直したおすすめは、フォローが変わらなくても304にしない
+        recommendations.store([(self.user.pk, [(self.users[5].pk, 9)])])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user.username for user in response.context["recommendations"]], ["user5"])
+        # 他のユーザーのプロフィールのETagはおすすめに関係しない
+        url = reverse("accounts:profile", kwargs={"username": "user2"})
+        etag = self.client.get(url)["ETag"]
+        recommendations.store([(self.user.pk, [])])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_follow_invalidates_stored(self):
+        self.client.login(username=self.user.username, password="testpassword")
+        url = reverse("accounts:profile", kwargs={"username": self.user.username})
+        self.client.get(url)
+        self.client.post(reverse("accounts:follow", kwargs={"username": "user4"}))
+        response = self.client.get(url)
+        self.assertEqual([user.username for user in response.context["recommendations"]], ["user5"])
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "user4"}))
+        response = self.client.get(url)
+        self.assertEqual([user.username for user in response.context["recommendations"]], ["user4", "user5"])
+
+    def test_not_shown_on_other_profiles(self):
+        self.client.login(username=self.user.username, password="testpassword")
+        response = self.client.get(reverse("accounts:profile", kwargs={"username": "user2"}))
+        self.assertNotIn("recommendations", response.context)
+        self.assertNotContains(response, "おすすめユーザー")
+
+
+class TestRelationships(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username="viewer", password="testpassword")
+        self.following, self.follower, self.mutual, self.stranger = User.objects.bulk_create(
+            [User(username=name) for name in ("following", "follower", "mutual", "stranger")]
+        )
+        Friendship.objects.bulk_create(
+            [
+                Friendship(follower=self.viewer, following=self.following),
+                Friendship(follower=self.follower, following=self.viewer),
+                Friendship(follower=self.viewer, following=self.mutual),
+                Friendship(follower=self.mutual, following=self.viewer),
+                Friendship(follower=self.stranger, following=self.following),
+            ]
+        )
+        self.client.login(username="viewer", password="testpassword")
+
+    def test_get_relationships(self):
+        users = [self.following, self.follower, self.mutual, self.stranger, self.viewer]
+        with self.assertNumQueries(1):
+            found = get_relationships(self.viewer, [user.pk for user in users])
+        self.assertEqual(found[self.following.pk], Relationship(following=True))
+        self.assertEqual(found[self.follower.pk], Relationship(followed_by=True))
+        self.assertEqual(found[self.mutual.pk], Relationship(following=True, followed_by=True))
+        self.assertTrue(found[self.mutual.pk].mutual)
+        self.assertFalse(found[self.following.pk].mutual)
+        self.assertEqual(found[self.stranger.pk], Relationship())
+        self.assertEqual(found[self.viewer.pk], Relationship())
+
+    def test_no_query_without_ids_or_login(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_relationships(self.viewer, []), {})
+            self.assertEqual(
+                get_relationships(AnonymousUser(), [self.following.pk]), {self.following.pk: Relationship()}
+            )
+
+    def test_attach_relationships(self):
+        rows = list(Friendship.objects.filter(following=self.viewer).order_by("follower__username"))
+        with self.assertNumQueries(1):
+            attach_relationships(self.viewer, rows, lambda row: row.follower_id)
+        self.assertEqual([row.relationship.mutual for row in rows], [False, True])
+
+    def test_follower_list_has_follow_back_buttons(self):
+        url = reverse("accounts:follower_list", kwargs={"username": self.viewer.username})
+        response = self.client.get(url)
+        self.assertContains(response, "フォローを返す", count=1)
+        self.assertContains(response, "相互フォロー", count=1)
+        # フォロワーが増えてもクエリ数は変わらない
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        followers = User.objects.bulk_create([User(username="follower{}".format(i)) for i in range(5)])
+        Friendship.objects.bulk_create(Friendship(follower=user, following=self.viewer) for user in followers)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, "フォローを返す", count=6)
+
+    def test_following_list(self):
+        url = reverse("accounts:following_list", kwargs={"username": self.stranger.username})
+        response = self.client.get(url)
+        self.assertEqual(response.context["following_list"][0].relationship, Relationship(following=True))
+        self.assertContains(response, "フォローを外す", count=1)
+
+    def test_profile(self):
+        response = self.client.get(reverse("accounts:profile", kwargs={"username": self.follower.username}))
+        self.assertEqual(response.context["relationship"], Relationship(followed_by=True))
+        self.assertFalse(response.context["is_following"])
+        self.assertContains(response, "フォローされています")
+        self.assertContains(response, "フォローを返す")
+        response = self.client.get(reverse("accounts:profile", kwargs={"username": self.viewer.username}))
+        self.assertNotContains(response, "フォローする</button>")
+
+    def test_api(self):
+        url = reverse("accounts:api_relationships")
+        response = self.client.get(url, {"ids": "{},{}".format(self.mutual.pk, self.stranger.pk)})
+        self.assertEqual(
+            response.json(),
+            {
+                "relationships": {
+                    str(self.mutual.pk): {"following": True, "followed_by": True, "mutual": True},
+                    str(self.stranger.pk): {"following": False, "followed_by": False, "mutual": False},
+                }
+            },
+        )
+        self.assertEqual(self.client.get(url, {"ids": "1,a"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"ids": ",".join(["1"] * 101)}).status_code, 400)
+
+
+class TestReconcileFollowCountsCommand(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword", follower_count=3)
+        Friendship.objects.create(follower=self.user1, following=self.user2)
+        Friendship.objects.create(follower=self.user2, following=self.user1)
+
+    def test_fix_drifted_counts(self):
+        out = StringIO()
+        call_command("reconcile_follow_counts", stdout=out)
+        self.assertIn("2人", out.getvalue())
+        for user in (self.user1, self.user2):
+            user.refresh_from_db()
+            self.assertEqual((user.follower_count, user.following_count), (1, 1))
+
+    def test_dry_run(self):
+        call_command("reconcile_follow_counts", "--dry-run", stdout=StringIO())
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.follower_count, 3)
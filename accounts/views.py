@@ -3,13 +3,19 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, DetailView, ListView, View
 
-from tweets.models import Like, Tweet
+from tweets import stats, timeline, versions
+from tweets.models import Tweet
+from tweets.pagination import CursorPaginationMixin
+from tweets.streaming import StreamingTweetListMixin
 
+from . import recommendations, relationships
 from .forms import LoginForm, SignupForm
 from .models import Friendship
 
@@ -36,24 +42,56 @@ class LoginView(auth_views.LoginView):
     # form_classにform.pyで定義したLoginFormを指定することで、ログイン処理時にLoginFormで定義したフォームデザインが適用される。
 
 
-class UserProfileView(LoginRequiredMixin, DetailView):
+class UserProfileView(LoginRequiredMixin, versions.ConditionalGetMixin, StreamingTweetListMixin, DetailView):
     model = User
     template_name = "accounts/profile.html"
+    stream_item_template_name = "accounts/profile_tweet.html"
     slug_field = "username"  # URLの末尾を指定
     slug_url_kwarg = "username"
 
+    def get_queryset(self):
+        # ツイート数などのヘッダーとおすすめユーザーは主キーで結合して、ユーザーと一緒に1回のクエリで取得する
+        return User.objects.select_related("stats", "recommendation")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.object
-        context["tweet_list"] = Tweet.objects.select_related("user").filter(user=user)  # TweetCreateViewで作ったツイートの一覧を作成
-        context["following"] = Friendship.objects.filter(follower=user).count()
-        context["follower"] = Friendship.objects.filter(following=user).count()
-        context["is_following"] = Friendship.objects.filter(following=user, follower=self.request.user).exists()
-        context["liked_list"] = (
-            Like.objects.select_related("tweet").filter(user=self.request.user).values_list("tweet", flat=True)
-        )
+        context["stats"] = stats.get_stats(user)
+        # TweetCreateViewで作ったツイートの一覧を、いいね数といいね済みかどうかと一緒に取得
+        context["tweet_list"] = Tweet.objects.with_engagement(self.request.user).filter(user=user)
+        context["following"] = user.following_count
+        context["follower"] = user.follower_count
+        context["relationship"] = relationships.get_relationships(self.request.user, [user.pk])[user.pk]
+        context["is_following"] = context["relationship"].following
+        if user == self.request.user:
+            # 自分のプロフィールだけに表示する。計算し直したかどうかはget_page_versionsでETagに含める
+            context["recommendations"] = recommendations.get_recommendations(user)
         return context
 
+    def get_version_scopes(self):
+        # フォローしているかどうかは、フォローした時に相手のfriendsのバージョンも更新するので閲覧者の分は不要
+        row = User.objects.filter(username=self.kwargs["username"]).values_list("pk", "recommendation__computed_at")
+        row = row.first()
+        if row is None:
+            return None
+        user_id, recommended_at = row
+        # 自分のプロフィールのおすすめユーザーは、計算した日時をバージョンに加える。refresh_recommendationsは
+        # 別のプロセスで動くので、キャッシュのバージョンではなく保存したテーブルの値を使う
+        self.recommendations_version = None
+        if user_id == self.request.user.pk:
+            if not recommendations.is_fresh(recommended_at):
+                # 描画する時に集計し直すとETagと食い違うので、ここで集計し直しておく
+                recommended_at = recommendations.refresh_user(user_id)
+            self.recommendations_version = recommended_at.timestamp()
+        # いいねした数が変わるので、表示するユーザーのlikesのバージョンも見る
+        return [("tweets", user_id), ("friends", user_id), ("likes", user_id), ("likes", self.request.user.pk)]
+
+    def get_page_versions(self):
+        page_versions = super().get_page_versions()
+        if page_versions is None or getattr(self, "recommendations_version", None) is None:
+            return page_versions
+        return [*page_versions, self.recommendations_version]
+
 
 class FollowView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
@@ -63,12 +101,20 @@ class FollowView(LoginRequiredMixin, View):
         if follower == following:
             return HttpResponseBadRequest("自分自身をフォローすることはできません")
 
-        if Friendship.objects.filter(follower=follower, following=following).exists():
+        try:
+            # exists()で確認してから作成すると同時リクエストで重複するため、unique_friendshipに任せて1回のINSERTで判定する
+            with transaction.atomic():  # フォローの追加とフォロー数・フォロワー数の更新を同じトランザクションで行う
+                Friendship.objects.create(follower=follower, following=following)
+                User.objects.filter(pk=follower.pk).update(following_count=F("following_count") + 1)
+                User.objects.filter(pk=following.pk).update(follower_count=F("follower_count") + 1)
+        except IntegrityError:
             messages.warning(request, "あなたはすでに{}をフォローしています".format(following.username))
             return redirect("tweets:home")
 
         else:
-            Friendship.objects.create(follower=follower, following=following)
+            timeline.backfill(follower, following)
+            versions.bump("friends", follower.pk, following.pk)
+            recommendations.invalidate(follower.pk)
             messages.success(request, "{}をフォローしました".format(following.username))
             return redirect("tweets:home")
 
@@ -82,29 +128,49 @@ class UnFollowView(LoginRequiredMixin, View):
             return HttpResponseBadRequest("自分自身のフォローを外せません")
 
         else:
-            friendship = Friendship.objects.filter(follower=follower, following=following)
-            friendship.delete()
+            with transaction.atomic():
+                deleted, _ = Friendship.objects.filter(follower=follower, following=following).delete()
+                if deleted:  # カウンタがずれていても負の値にはしない
+                    User.objects.filter(pk=follower.pk, following_count__gte=deleted).update(
+                        following_count=F("following_count") - deleted
+                    )
+                    User.objects.filter(pk=following.pk, follower_count__gte=deleted).update(
+                        follower_count=F("follower_count") - deleted
+                    )
+            if deleted:
+                versions.bump("friends", follower.pk, following.pk)
+                recommendations.invalidate(follower.pk)
+            timeline.remove(follower, following)
             messages.success(request, "{}のフォローを外しました".format(following.username))
             return redirect("tweets:home")
 
 
-class FollowerListView(LoginRequiredMixin, ListView):
-    model = User
+class FollowerListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     template_name = "accounts/follower_list.html"
+    context_object_name = "follower_list"
+    cursor_ordering = ("-created_time_date", "-id")  # 新しくフォローされた順
+
+    def get_queryset(self):
+        user = get_object_or_404(User, username=self.kwargs["username"])
+        return Friendship.objects.select_related("follower").filter(following=user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = get_object_or_404(User, username=self.kwargs["username"])
-        context["follower_list"] = Friendship.objects.select_related("follower").filter(following=user)
+        # フォロワーごとに閲覧者との関係(フォローボタンの表示)を1回のクエリでまとめて取得
+        relationships.attach_relationships(self.request.user, context["follower_list"], lambda row: row.follower_id)
         return context
 
 
-class FollowingListView(LoginRequiredMixin, ListView):
-    model = User
+class FollowingListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     template_name = "accounts/following_list.html"
+    context_object_name = "following_list"
+    cursor_ordering = ("-created_time_date", "-id")  # 新しくフォローした順
+
+    def get_queryset(self):
+        user = get_object_or_404(User, username=self.kwargs["username"])
+        return Friendship.objects.select_related("following").filter(follower=user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = get_object_or_404(User, username=self.kwargs["username"])
-        context["following_list"] = Friendship.objects.select_related("following").filter(follower=user)
+        relationships.attach_relationships(self.request.user, context["following_list"], lambda row: row.following_id)
         return context
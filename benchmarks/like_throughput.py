@@ -0,0 +1,153 @@
+"""いいね/いいね取り消しの同期ビューと非同期ビューのスループットをuvicornで比較する
+
+    pip install uvicorn
+    python -m benchmarks.like_throughput --concurrency 50 --requests 2000
+
+一時ディレクトリのSQLiteにユーザーとツイートを作り、uvicornを起動して同時接続数concurrencyで
+いいねといいね取り消しを交互に送る。ユーザーごとにセッションを作ってログイン済みの状態にする。
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CSRF_TOKEN = "a" * 32
+
+VARIANTS = {
+    "sync": ("/tweets/{}/like/", "/tweets/{}/unlike/"),
+    "async": ("/tweets/{}/like/async/", "/tweets/{}/unlike/async/"),
+}
+
+
+def setup(db_name, users, tweets):
+    """ユーザーとツイートを作り、ユーザーごとのセッションキーを返す"""
+    import django
+
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.core.management import call_command
+
+    from tweets.models import Tweet
+
+    User = get_user_model()
+    call_command("migrate", verbosity=0)
+    author = User.objects.create(username="author")
+    tweet_ids = [
+        tweet.pk for tweet in Tweet.objects.bulk_create(Tweet(user=author, content="tweet") for _ in range(tweets))
+    ]
+
+    session_keys = []
+    for user in User.objects.bulk_create(User(username="user{}".format(i)) for i in range(users)):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        session_keys.append(session.session_key)
+    return tweet_ids, session_keys
+
+
+async def post(reader, writer, path, session_key):
+    writer.write(
+        (
+            "POST {} HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Cookie: sessionid={}; csrftoken={}\r\n"
+            "X-CSRFToken: {}\r\n"
+            "Content-Length: 0\r\n\r\n"
+        )
+        .format(path, session_key, CSRF_TOKEN, CSRF_TOKEN)
+        .encode()
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) != b"\r\n":
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(port, session_key, tweet_ids, paths, count, latencies):
+    """1人のユーザーとしてcount回、いいねといいね取り消しを交互に送る"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for i in range(count):
+        path = paths[i % 2].format(tweet_ids[i // 2 % len(tweet_ids)])
+        start = time.perf_counter()
+        status = await post(reader, writer, path, session_key)
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError("{} returned {}".format(path, status))
+    writer.close()
+
+
+async def run(port, session_keys, tweet_ids, paths, requests):
+    latencies = []
+    per_client = requests // len(session_keys)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, key, tweet_ids, paths, per_client, latencies) for key in session_keys))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError("uvicornが起動しませんでした")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000, help="1つのビューに送るリクエスト数")
+    parser.add_argument("--tweets", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = str(Path(directory) / "bench.sqlite3")
+        tweet_ids, session_keys = setup(db_name, args.concurrency, args.tweets)
+        env = {**os.environ, "DB_NAME": db_name}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "mysite.asgi:application", "--port", str(args.port), "--no-access-log"],
+            cwd=BASE_DIR,
+            env=env,
+        )
+        try:
+            wait_for_port(args.port)
+            print("{:<8}{:>10}{:>10}{:>10}".format("view", "req/s", "p50_ms", "p99_ms"))
+            for name, paths in VARIANTS.items():
+                result = asyncio.run(run(args.port, session_keys, tweet_ids, paths, args.requests))
+                print(
+                    "{:<8}{:>10.1f}{:>10.1f}{:>10.1f}".format(name, result["rps"], result["p50_ms"], result["p99_ms"])
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""ツイート検索の転置インデックスとcontent__icontainsの速度を比較する
+
+    python -m benchmarks.search --tweets 1000000
+
+一時ディレクトリのSQLiteに日本語の単語を組み合わせたツイートをtweets件作って検索インデックスを作り直し、
+よく出る語・たまに出る語・まれな語・存在しない語で、検索の最初のページ(20件)を取得する時間を比較する。
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+
+WORDS = ["東京", "大阪", "ラーメン", "勉強会", "天気", "電車", "猫", "コーヒー", "週末", "映画", "Django", "Python"]
+RARE_WORD = "名古屋城"
+RARE_RATE = 0.0001
+QUERIES = {
+    "common": "天気",
+    "two_words": "東京 ラーメン",
+    "rare": RARE_WORD,
+    "missing": "北海道",
+}
+
+
+def tweets(rng, count):
+    for _ in range(count):
+        words = rng.sample(WORDS, 3)
+        if rng.random() < RARE_RATE:
+            words.append(RARE_WORD)
+        yield "今日は{}で{}、{}の話".format(*words) + "".join(words[3:])
+
+
+def setup(db_name, count, batch_size):
+    import django
+
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import transaction
+
+    from search.index import rebuild
+    from tweets.models import Tweet
+
+    User = get_user_model()
+    call_command("migrate", verbosity=0)
+    user = User.objects.create(username="author")
+    rng = random.Random(0)
+    contents = tweets(rng, count)
+    for start in range(0, count, batch_size):
+        batch = islice(contents, batch_size)
+        with transaction.atomic():
+            Tweet.objects.bulk_create(Tweet(user=user, content=content) for content in batch)
+    start = time.perf_counter()
+    rebuild(batch_size=batch_size)
+    return time.perf_counter() - start
+
+
+def measure(paginator, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page = paginator.page()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, len(page)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tweets", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        rebuild_seconds = setup(str(Path(directory) / "bench.sqlite3"), args.tweets, args.batch_size)
+        print("{}件のツイートのインデックスを{:.1f}秒で作成しました".format(args.tweets, rebuild_seconds))
+
+        from search.pagination import SearchPaginator
+        from tweets.models import Tweet
+        from tweets.pagination import CursorPaginator
+
+        print("{:<12}{:>8}{:>14}{:>16}".format("query", "hits", "index_ms", "icontains_ms"))
+        for name, query in QUERIES.items():
+            index_ms, hits = measure(SearchPaginator(Tweet.objects.all(), query), args.repeat)
+            icontains = Tweet.objects.all()
+            for word in query.split():
+                icontains = icontains.filter(content__icontains=word)
+            icontains_ms, _ = measure(CursorPaginator(icontains, ("-id",)), args.repeat)
+            print("{:<12}{:>8}{:>14.1f}{:>16.1f}".format(name, hits, index_ms, icontains_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+
+from accounts.models import Friendship
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+PASSWORD = "testpassword"
+HASHED_PASSWORD = make_password(PASSWORD)  # ユーザーごとにハッシュ化すると遅いので使い回す
+
+
+def seed(target, users, tweets_per_user=3):
+    """targetと相互フォローしているusers人分のユーザー、ツイート、いいね、タイムラインを追加する
+
+    追加したユーザーはそれぞれtweets_per_user件ツイートし、targetのツイートに1件ずつ
+    いいねする。targetもユーザー1人につき1件ツイートする。
+    """
+    offset = User.objects.count()
+    new_users = User.objects.bulk_create(
+        User(username="bench{}".format(offset + i), password=HASHED_PASSWORD) for i in range(users)
+    )
+    Friendship.objects.bulk_create(
+        [Friendship(follower=target, following=user) for user in new_users]
+        + [Friendship(follower=user, following=target) for user in new_users]
+    )
+    tweets = Tweet.objects.bulk_create(
+        Tweet(user=user, content="tweet{}".format(i)) for user in new_users for i in range(tweets_per_user)
+    )
+    TimelineEntry.objects.bulk_create(
+        TimelineEntry(owner=target, tweet=tweet, created_at=tweet.created_at) for tweet in tweets
+    )
+    target_tweets = Tweet.objects.bulk_create(Tweet(user=target, content="target") for _ in new_users)
+    Like.objects.bulk_create(Like(tweet=tweet, user=user) for user in new_users for tweet in target_tweets)
+    Like.objects.bulk_create(Like(tweet=tweet, user=target) for tweet in tweets[::2])
+    # bulk_createでは非正規化したカウンタが更新されないので、まとめて数え直す
+    call_command("reconcile_like_counts", stdout=StringIO())
+    call_command("reconcile_follow_counts", stdout=StringIO())
+    return new_users
@@ -0,0 +1,138 @@
+"""ビューごとのクエリ数・処理時間・メモリ使用量のベンチマーク
+
+データ量を変えて同じリクエストを送り、クエリ数がデータ量によって増えていたら失敗する(N+1の検出)。
+データ量はBENCHMARK_SCALE(1単位=ユーザー5人)で変えられる。
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts import recommendations
+from tweets import trending
+from tweets.models import Tweet
+
+from .seed import HASHED_PASSWORD, PASSWORD, seed
+
+User = get_user_model()
+
+SCALE = int(os.environ.get("BENCHMARK_SCALE", "1"))
+USERS_PER_SCALE = 5
+
+
+def measure(request):
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return response, {"queries": len(queries), "ms": elapsed * 1000, "peak_kib": peak / 1024}
+
+
+class ViewBenchmark(TestCase):
+    scales = (SCALE, SCALE * 4)
+    results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.results:
+            sys.stderr.write("\n{:<16}{:>8}{:>10}{:>10}{:>12}\n".format("view", "users", "queries", "ms", "peak_kib"))
+            for name, users, result in cls.results:
+                sys.stderr.write(
+                    "{:<16}{:>8}{:>10}{:>10.1f}{:>12.1f}\n".format(
+                        name, users, result["queries"], result["ms"], result["peak_kib"]
+                    )
+                )
+
+    def setUp(self):
+        self.user = User.objects.create(username="benchuser", password=HASHED_PASSWORD)
+        self.client.login(username="benchuser", password=PASSWORD)
+
+    def benchmark(self, name, request, prepare=lambda users: None):
+        """データを増やしながらrequestを実行し、クエリ数が変わらないことを確認する
+
+        prepareの戻り値がrequestに渡される。prepareのクエリは計測しない。
+        """
+        query_counts = []
+        seeded = 0
+        for scale in self.scales:
+            users = scale * USERS_PER_SCALE
+            seed(self.user, users - seeded)
+            seeded = users
+            self.user.refresh_from_db()
+            prepared = prepare(users)
+            response, result = measure(lambda: request(prepared))
+            self.assertLess(response.status_code, 400)
+            self.results.append((name, users, result))
+            query_counts.append(result["queries"])
+        self.assertEqual(
+            len(set(query_counts)), 1, "{}のクエリ数がデータ量で増えています: {}".format(name, query_counts)
+        )
+
+    def latest_tweet(self, users):
+        return Tweet.objects.filter(user=self.user).latest("created_at").pk
+
+    def test_home(self):
+        self.benchmark("home", lambda _: self.client.get(reverse("tweets:home")))
+
+    def test_trending(self):
+        # seedはbulk_createでいいねを追加するので、スコアを計算し直しておく
+        self.benchmark(
+            "trending", lambda _: self.client.get(reverse("tweets:trending")), lambda users: trending.rebuild()
+        )
+
+    def test_profile(self):
+        url = reverse("accounts:profile", kwargs={"username": self.user.username})
+        # おすすめユーザーは保存されていない時(表示時に集計する時)を計測する
+        self.benchmark(
+            "profile", lambda _: self.client.get(url), lambda users: recommendations.invalidate(self.user.pk)
+        )
+
+    def test_profile_not_modified(self):
+        url = reverse("accounts:profile", kwargs={"username": self.user.username})
+        self.benchmark(
+            "profile_304",
+            lambda etag: self.client.get(url, HTTP_IF_NONE_MATCH=etag),
+            lambda users: self.client.get(url)["ETag"],
+        )
+
+    def test_tweet_detail(self):
+        self.benchmark(
+            "tweet_detail", lambda pk: self.client.get(reverse("tweets:detail", kwargs={"pk": pk})), self.latest_tweet
+        )
+
+    def test_like(self):
+        self.benchmark(
+            "like", lambda pk: self.client.post(reverse("tweets:like", kwargs={"pk": pk})), self.latest_tweet
+        )
+
+    def test_follow(self):
+        def prepare(users):
+            # フォローした時に過去のツイートがタイムラインに追加されるので、データ量に比例してツイートさせておく
+            following = User.objects.create(username="following{}".format(users), password=HASHED_PASSWORD)
+            Tweet.objects.bulk_create(Tweet(user=following, content="tweet") for _ in range(users))
+            return following.username
+
+        self.benchmark(
+            "follow",
+            lambda username: self.client.post(reverse("accounts:follow", kwargs={"username": username})),
+            prepare,
+        )
+
+    def test_follower_list(self):
+        url = reverse("accounts:follower_list", kwargs={"username": self.user.username})
+        self.benchmark("follower_list", lambda _: self.client.get(url))
+
+    def test_following_list(self):
+        url = reverse("accounts:following_list", kwargs={"username": self.user.username})
+        self.benchmark("following_list", lambda _: self.client.get(url))
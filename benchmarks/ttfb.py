@@ -0,0 +1,90 @@
+"""プロフィールの通常の描画とストリーミング描画で、最初の1バイトまでの時間とメモリ使用量を比較する
+
+    python -m benchmarks.ttfb --tweets 2000
+
+一時ディレクトリのSQLiteにtweets件ツイートしたユーザーを作り、プロフィールを通常の描画(TemplateResponse)と
+ストリーミング(?stream=1)で取得する。レスポンスの本文は読み捨てるので、メモリのピークは描画に使った分になる。
+ツイートのフラグメントキャッシュがCACHESのMAX_ENTRIESに収まらない件数にすると、キャッシュの入れ替えの分も計測される。
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+VARIANTS = {
+    "template": "?stream=0",
+    "stream": "?stream=1",
+}
+
+
+def setup(db_name, tweets):
+    """tweets件ツイートしたユーザーを作り、ログイン済みのクライアントとプロフィールのURLを返す"""
+    import django
+
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+    from django.urls import reverse
+
+    from tweets.models import Tweet
+
+    User = get_user_model()
+    call_command("migrate", verbosity=0)
+    user = User.objects.create(username="author")
+    Tweet.objects.bulk_create((Tweet(user=user, content="tweet {}".format(i)) for i in range(tweets)), batch_size=1000)
+
+    client = Client(SERVER_NAME="localhost")
+    client.force_login(user)
+    return client, reverse("accounts:profile", kwargs={"username": user.username})
+
+
+def measure(client, url):
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url)
+    if response.streaming:
+        chunks = iter(response.streaming_content)
+        size = len(next(chunks))
+        first_byte = time.perf_counter() - start
+        size += sum(len(chunk) for chunk in chunks)
+    else:
+        first_byte = time.perf_counter() - start
+        size = len(response.content)
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if response.status_code != 200:
+        raise RuntimeError("{} returned {}".format(url, response.status_code))
+    return {"ttfb_ms": first_byte * 1000, "total_ms": total * 1000, "peak_kib": peak / 1024, "kib": size / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tweets", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        client, url = setup(str(Path(directory) / "bench.sqlite3"), args.tweets)
+        client.get(url)  # テンプレートの読み込みとフラグメントキャッシュを温めておく
+        print("{:<10}{:>10}{:>10}{:>12}{:>10}".format("mode", "ttfb_ms", "total_ms", "peak_kib", "kib"))
+        for name, query in VARIANTS.items():
+            results = [measure(client, url + query) for _ in range(args.repeat)]
+            median = {key: statistics.median(result[key] for result in results) for key in results[0]}
+            print(
+                "{:<10}{:>10.1f}{:>10.1f}{:>12.1f}{:>10.1f}".format(
+                    name, median["ttfb_ms"], median["total_ms"], median["peak_kib"], median["kib"]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """SQLiteへの新しい接続にsettings.SQLITE_PRAGMASを設定する(connection_createdシグナルのレシーバー)"""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute("PRAGMA {} = {}".format(name, value))
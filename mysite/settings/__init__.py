@@ -0,0 +1,3 @@
+"""開発用の設定(DJANGO_SETTINGS_MODULEのデフォルト)"""
+
+from .base import *  # noqa: F401,F403
@@ -0,0 +1,205 @@
+"""
+Django settings for mysite project.
+開発・本番で共通の設定。開発はmysite.settings、本番はmysite.settings.prodを使う。
+Generated by 'django-admin startproject' using Django 4.0.3.
+For more information on this file, see
+https://docs.djangoproject.com/en/4.0/topics/settings/
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/4.0/ref/settings/
+"""
+
+
+import os
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = "django-insecure-x+hlabr82)0gfep+bo%6nsehz_n%5_w4*9u*pd9tllw10dj1s1"
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+ALLOWED_HOSTS = []
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "accounts.apps.AccountsConfig",
+    "tweets.apps.TweetsConfig",
+    "search.apps.SearchConfig",
+    "welcome.apps.WelcomeConfig",
+    "mysite.apps.MysiteConfig",
+]
+
+MIDDLEWARE = [
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+ROOT_URLCONF = "mysite.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [BASE_DIR / "templates"],
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.debug",
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = "mysite.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+
+# DB_ENGINE=postgresqlでPostgreSQL(要psycopg2)、それ以外はSQLiteを使う
+# 接続はCONN_MAX_AGE秒使い回し、使い回す前にCONN_HEALTH_CHECKSで切れていないか確認する
+
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "mysite"),
+            "USER": os.environ.get("DB_USER", ""),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", ""),
+            "PORT": os.environ.get("DB_PORT", ""),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            # PgBouncerのトランザクションプーリング経由で接続する場合はサーバーサイドカーソルが使えない
+            "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("DB_PGBOUNCER") == "1",
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "mysite.sqlite3",  # トランザクションをBEGIN IMMEDIATEで始める(mysite/sqlite3/base.py)
+            "NAME": os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {"timeout": 5},  # ロック中のDBへの書き込みを諦めるまで待つ秒数
+        }
+    }
+
+# SQLiteに接続するたびに実行するPRAGMA(mysite/db.py)
+# WALにすると読み込みと書き込みが互いを待たなくなり、1台で動かす場合の同時アクセスに強くなる
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # WALではコミットごとのfsyncを省いても壊れない(電源断で直近のコミットが失われうる)
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+
+
+# Password validation
+# https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/4.0/topics/i18n/
+
+LANGUAGE_CODE = "ja"
+
+TIME_ZONE = "Asia/Tokyo"
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/4.0/howto/static-files/
+
+STATIC_URL = "static/"
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+AUTH_USER_MODEL = "accounts.User"
+
+LOGIN_URL = "accounts:login"  # 未認証のユーザーからのアクセスの場合
+
+LOGIN_REDIRECT_URL = "tweets:home"
+
+LOGOUT_REDIRECT_URL = "welcome:index"
+
+# ツイートのテンプレートフラグメントキャッシュ(tweets/cards.py)と条件付きGETのバージョン(tweets/versions.py)に使う
+# プロセスごとのメモリキャッシュなので、複数プロセスで動かす本番の設定(prod.py)ではRedisに変える
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+TIMELINE_FANOUT_THRESHOLD = 1000  # フォロワーがこれより多いユーザーのツイートはタイムラインに書き込まず表示時に取得する
+
+TIMELINE_BACKFILL_SIZE = 200  # フォローした時にタイムラインへ追加する過去のツイート数
+
+# トレンド(tweets/trending.py)のいいねの重みの半減期(秒)
+TRENDING_HALF_LIFE = 6 * 60 * 60
+
+TRENDING_EXPIRE_HALF_LIVES = 20  # スコアがこの半減期の回数分より古いいいね1件分を下回ったら削除する
+
+TRENDING_MAX_ENTRIES = 10000  # compact_trendingの後に残す件数
+
+# おすすめユーザー(accounts/recommendations.py)を計算し直すまでの秒数。manage.py refresh_recommendationsで計算し直す
+RECOMMENDATION_TTL = 24 * 60 * 60
+
+RECOMMENDATION_LIMIT = 5  # プロフィールに表示するおすすめの人数
+
+# Trueにするとホーム・プロフィールのツイート一覧をストリーミングで送る(tweets/streaming.py)。?stream=1/0でも切り替えられる
+# WSGIで動かす場合だけ有効で、ASGIでは常に通常の描画になる
+STREAM_TWEET_LISTS = False
+
+# Trueにするといいねをすぐには書き込まず、ログに溜めてまとめて反映する(tweets/like_buffer.py)
+LIKE_WRITE_BEHIND = False
+
+LIKE_BUFFER_PATH = BASE_DIR / "like_buffer.log"  # 同じサーバーのプロセス間で共有するいいねのログ
+
+LIKE_FLUSH_INTERVAL = 1.0  # ログを反映する間隔(秒)。Noneにするとmanage.py flush_likesだけで反映する
@@ -0,0 +1,44 @@
+"""本番用の設定
+
+DJANGO_SETTINGS_MODULE=mysite.settings.prod で使う。開発用の設定を元に、
+デバッグを無効にしてテンプレートやセッションのキャッシュなど性能に関わる設定を有効にする。
+"""
+
+import os
+
+from .base import *  # noqa: F401,F403
+from .base import TEMPLATES
+
+SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",")
+
+# 読み込んだテンプレートをプロセス内に保持し、リクエストごとにファイルを読んで構文解析しないようにする
+# loadersを指定する場合はAPP_DIRSを使えないので、app_directoriesローダーを明示する
+TEMPLATES[0]["APP_DIRS"] = False
+TEMPLATES[0]["OPTIONS"]["loaders"] = [
+    (
+        "django.template.loaders.cached.Loader",
+        [
+            "django.template.loaders.filesystem.Loader",
+            "django.template.loaders.app_directories.Loader",
+        ],
+    ),
+]
+
+# 起動時に全テンプレートを読み込んでおき、デプロイ直後のリクエストで構文解析しないようにする(mysite/warmup.py)
+WARM_TEMPLATES = True
+
+# 条件付きGETのバージョン(tweets/versions.py)やツイートの断片は、どのプロセスの更新も全プロセスで見えるよう
+# プロセスの外のRedisに置く(要redis)。プロセスごとのメモリキャッシュでは、更新を知らないプロセスが古いページに304を返す
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["DJANGO_REDIS_URL"],
+    }
+}
+
+# セッションをキャッシュに載せ、リクエストごとのDB読み込みを減らす
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
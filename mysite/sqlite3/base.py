@@ -0,0 +1,13 @@
+"""トランザクションをBEGIN IMMEDIATEで始めるSQLiteバックエンド
+
+Djangoの標準のバックエンドはBEGIN(DEFERRED)でトランザクションを始めるので、読み込んだ後に書き込もうとした時点で
+他の接続が書き込み中だと、busy_timeoutを待たずに"database is locked"になる。
+最初に書き込みロックを取っておけば、他の接続の書き込みが終わるまでbusy_timeoutの間待つようになる。
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
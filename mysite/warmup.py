@@ -0,0 +1,32 @@
+"""起動時にテンプレートを読み込んでおく
+
+キャッシュ付きのテンプレートローダーはプロセスごとに読み込んだテンプレートを保持するので、
+wsgi.py/asgi.pyでアプリケーションを作った直後に呼び出す。
+"""
+
+from pathlib import Path
+
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+
+
+def template_names(engine):
+    """engineのローダーが探すディレクトリにある.htmlファイルの名前"""
+    names = set()
+    for loader in engine.engine.template_loaders:
+        for directory in loader.get_dirs():
+            directory = Path(directory)
+            names.update(path.relative_to(directory).as_posix() for path in directory.rglob("*.html"))
+    return sorted(names)
+
+
+def warm_templates():
+    """全テンプレートを読み込んで構文解析し、読み込んだ数を返す。構文エラーがあれば例外を送出する"""
+    count = 0
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        for name in template_names(engine):
+            engine.get_template(name)
+            count += 1
+    return count
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+class SearchConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "search"
+
+    def ready(self):
+        from tweets.models import Tweet
+
+        from .signals import index_saved_tweet, unindex_deleted_tweet
+
+        post_save.connect(index_saved_tweet, sender=Tweet, dispatch_uid="index_saved_tweet")
+        post_delete.connect(unindex_deleted_tweet, sender=Tweet, dispatch_uid="unindex_deleted_tweet")
@@ -0,0 +1,148 @@
+"""検索インデックスのバックエンド
+
+tokenize()したトークンを、SQLiteではFTS5の仮想テーブル、PostgreSQLではtsvectorのカラムとGINインデックスに
+保存する。どちらもDBの分かち書きは使わず、トークンをそのまま転置インデックスに入れる。
+それ以外のDBではインデックスを作らず、トークンごとのcontent__icontainsで検索する(全件走査になる)。
+
+検索結果はツイートのidの降順に、カーソルのidより後ろのlimit件を取り出す。SQLiteのFTS5はrowidの順に
+転置インデックスを読むので、多くのツイートに含まれる語でも1ページ分を読んだところで止まる。
+"""
+
+from django.db.models import Q
+
+from .tokenizer import is_cjk
+
+TABLE = "search_tweetindex"
+
+
+def is_prefix(token):
+    """bigramより短い1文字の日本語は、その文字で始まるトークン(bigramと連続の最後の1文字)を前方一致で探す"""
+    return len(token) == 1 and is_cjk(token)
+
+
+def select_ids(cursor, id_column, condition, param, position, backwards, limit):
+    sql = "SELECT {} FROM {} WHERE {}".format(id_column, TABLE, condition)
+    params = [param]
+    if position is not None:
+        sql += " AND {} {} %s".format(id_column, ">" if backwards else "<")
+        params.append(position)
+    sql += " ORDER BY {} {} LIMIT %s".format(id_column, "ASC" if backwards else "DESC")
+    params.append(limit)
+    cursor.execute(sql, params)
+    return [pk for pk, in cursor.fetchall()]
+
+
+class SQLiteBackend:
+    def create(self, cursor):
+        # rowidにツイートのidを入れる
+        cursor.execute(
+            'CREATE VIRTUAL TABLE {} USING fts5(tokens, tokenize="unicode61 remove_diacritics 0")'.format(TABLE)
+        )
+
+    def drop(self, cursor):
+        cursor.execute("DROP TABLE IF EXISTS {}".format(TABLE))
+
+    def index(self, cursor, rows):
+        """[(tweet_id, トークンのリスト), ...]を追加する(追加済みのツイートは置き換える)"""
+        self.delete(cursor, [pk for pk, _ in rows])
+        cursor.executemany(
+            "INSERT INTO {}(rowid, tokens) VALUES (%s, %s)".format(TABLE),
+            [(pk, " ".join(tokens)) for pk, tokens in rows],
+        )
+
+    def delete(self, cursor, pks):
+        if pks:
+            cursor.execute("DELETE FROM {} WHERE rowid IN ({})".format(TABLE, ", ".join(["%s"] * len(pks))), list(pks))
+
+    def clear(self, cursor):
+        cursor.execute("DELETE FROM {}".format(TABLE))
+
+    def optimize(self, cursor):
+        """FTS5のセグメントを1つにまとめる(再構築の後に実行する)"""
+        cursor.execute("INSERT INTO {0}({0}) VALUES ('optimize')".format(TABLE))
+
+    def match_ids(self, cursor, tokens, position, backwards, limit):
+        """tokensをすべて含むツイートのidを、idの降順(backwardsなら昇順)にpositionより後ろからlimit件返す"""
+        terms = []
+        for token in tokens:
+            term = '"{}"'.format(token.replace('"', '""'))
+            terms.append(term + "*" if is_prefix(token) else term)
+        # 空白で区切った語はすべて含むもの(AND)にマッチする
+        return select_ids(cursor, "rowid", "{} MATCH %s".format(TABLE), " ".join(terms), position, backwards, limit)
+
+
+class PostgreSQLBackend:
+    def create(self, cursor):
+        cursor.execute(
+            "CREATE TABLE {} ("
+            "tweet_id bigint PRIMARY KEY REFERENCES tweets_tweet (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,"
+            " tokens tsvector NOT NULL)".format(TABLE)
+        )
+        cursor.execute("CREATE INDEX {0}_tokens ON {0} USING gin (tokens)".format(TABLE))
+
+    def drop(self, cursor):
+        cursor.execute("DROP TABLE IF EXISTS {}".format(TABLE))
+
+    def index(self, cursor, rows):
+        # to_tsvectorは分かち書きや正規化をするので、array_to_tsvectorでトークンをそのまま入れる
+        cursor.executemany(
+            "INSERT INTO {} (tweet_id, tokens) VALUES (%s, array_to_tsvector(%s::text[])) "
+            "ON CONFLICT (tweet_id) DO UPDATE SET tokens = EXCLUDED.tokens".format(TABLE),
+            [(pk, tokens) for pk, tokens in rows],
+        )
+
+    def delete(self, cursor, pks):
+        if pks:
+            cursor.execute("DELETE FROM {} WHERE tweet_id = ANY(%s)".format(TABLE), [list(pks)])
+
+    def clear(self, cursor):
+        cursor.execute("TRUNCATE {}".format(TABLE))
+
+    def optimize(self, cursor):
+        cursor.execute("VACUUM ANALYZE {}".format(TABLE))
+
+    def match_ids(self, cursor, tokens, position, backwards, limit):
+        terms = []
+        for token in tokens:
+            term = "'{}'".format(token.replace("\\", "\\\\").replace("'", "''"))
+            terms.append(term + ":*" if is_prefix(token) else term)
+        # to_tsqueryも正規化するので、tsqueryへのキャストでトークンをそのまま使う
+        return select_ids(cursor, "tweet_id", "tokens @@ %s::tsquery", " & ".join(terms), position, backwards, limit)
+
+
+class FallbackBackend:
+    def create(self, cursor):
+        pass
+
+    def drop(self, cursor):
+        pass
+
+    def index(self, cursor, rows):
+        pass
+
+    def delete(self, cursor, pks):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def optimize(self, cursor):
+        pass
+
+    def match_ids(self, cursor, tokens, position, backwards, limit):
+        from tweets.models import Tweet
+
+        queryset = Tweet.objects.filter(*[Q(content__icontains=token) for token in tokens])
+        if position is not None:
+            queryset = queryset.filter(**{"pk__gt" if backwards else "pk__lt": position})
+        return list(queryset.order_by("pk" if backwards else "-pk").values_list("pk", flat=True)[:limit])
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+    "postgresql": PostgreSQLBackend,
+}
+
+
+def get_backend(connection):
+    return BACKENDS.get(connection.vendor, FallbackBackend)()
@@ -0,0 +1,52 @@
+"""ツイートの検索インデックスの更新
+
+ツイートの作成・編集・削除はsignals.pyのレシーバーがインデックスに反映する。
+bulk_createなどシグナルを送らない書き込みの後は、manage.py rebuild_search_indexで作り直す。
+検索はpagination.pyのSearchPaginatorで行う。
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from tweets.models import Tweet
+
+from .backends import get_backend
+from .tokenizer import tokenize
+
+
+def index_tweets(tweets, using=DEFAULT_DB_ALIAS):
+    """[(tweet_id, 本文), ...]をインデックスに追加する"""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        get_backend(connection).index(cursor, [(pk, tokenize(content)) for pk, content in tweets])
+
+
+def unindex_tweets(pks, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        get_backend(connection).delete(cursor, pks)
+
+
+def rebuild(batch_size=1000, using=DEFAULT_DB_ALIAS):
+    """インデックスを空にして全ツイートを追加し直し、追加した件数を返す
+
+    ツイートはidの順にbatch_size件ずつ読み込むので、ツイートの数によらずメモリの使用量は一定。
+    """
+    connection = connections[using]
+    backend = get_backend(connection)
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+    count = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            Tweet.objects.using(using).filter(pk__gt=last_pk).order_by("pk").values_list("pk", "content")[:batch_size]
+        )
+        if not batch:
+            break
+        with transaction.atomic(using=using):
+            index_tweets(batch, using=using)
+        count += len(batch)
+        last_pk = batch[-1][0]
+    with connection.cursor() as cursor:
+        backend.optimize(cursor)
+    return count
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from search.index import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "ツイートの検索インデックスを作り直す(bulk_createなどシグナルを送らずに追加したツイートも検索できるようにする)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # 作り直している間は、まだ追加し直していないツイートが検索結果に出ない
+        count = rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("{}件のツイートを検索インデックスに追加しました".format(count)))
@@ -0,0 +1,62 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:02
+
+import re
+import unicodedata
+
+from django.db import migrations
+
+from search.backends import get_backend
+
+# マイグレーションの時点のトークナイザー(search/tokenizer.py)。後でトークナイザーを変えても
+# このマイグレーションで作るトークンは変わらないよう、コピーしておく
+CJK = r"[々〆ぁ-ヿ㐀-䶿一-鿿豈-﫿가-힯]"
+TOKEN_RE = re.compile(r"{cjk}+|(?:(?!{cjk})[^\W_])+".format(cjk=CJK))
+CJK_RE = re.compile(CJK)
+
+
+def tokenize(text):
+    tokens = {}
+    for run in TOKEN_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if CJK_RE.match(run) is not None and len(run) > 1:
+            for i in range(len(run) - 1):
+                tokens[run[i : i + 2]] = None
+        else:
+            tokens[run] = None
+    return list(tokens)
+
+
+def create_index(apps, schema_editor):
+    """DBごとの検索インデックスのテーブルを作り、既存のツイートを追加する"""
+    Tweet = apps.get_model("tweets", "Tweet")
+    connection = schema_editor.connection
+    backend = get_backend(connection)
+    with connection.cursor() as cursor:
+        backend.create(cursor)
+        last_pk = 0
+        while True:
+            batch = list(
+                Tweet.objects.using(connection.alias)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "content")[:1000]
+            )
+            if not batch:
+                break
+            backend.index(cursor, [(pk, tokenize(content)) for pk, content in batch])
+            last_pk = batch[-1][0]
+
+
+def drop_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        get_backend(schema_editor.connection).drop(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_timelineentry"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,59 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+from search.backends import get_backend
+
+# マイグレーションの時点のトークナイザー(search/tokenizer.py)。後でトークナイザーを変えても
+# このマイグレーションで作るトークンは変わらないよう、コピーしておく
+CJK = r"[々〆ぁ-ヿ㐀-䶿一-鿿豈-﫿가-힯]"
+TOKEN_RE = re.compile(r"{cjk}+|(?:(?!{cjk})[^\W_])+".format(cjk=CJK))
+CJK_RE = re.compile(CJK)
+
+
+def tokenize(text):
+    tokens = {}
+    for run in TOKEN_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if CJK_RE.match(run) is not None and len(run) > 1:
+            for i in range(len(run) - 1):
+                tokens[run[i : i + 2]] = None
+            tokens[run[-1]] = None
+        else:
+            tokens[run] = None
+    return list(tokens)
+
+
+def reindex(apps, schema_editor):
+    """連続の最後の1文字のトークンを追加するため、既存のツイートをインデックスに追加し直す"""
+    Tweet = apps.get_model("tweets", "Tweet")
+    connection = schema_editor.connection
+    backend = get_backend(connection)
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+        last_pk = 0
+        while True:
+            batch = list(
+                Tweet.objects.using(connection.alias)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "content")[:1000]
+            )
+            if not batch:
+                break
+            backend.index(cursor, [(pk, tokenize(content)) for pk, content in batch])
+            last_pk = batch[-1][0]
+    # PostgreSQLのVACUUMはトランザクションの中で実行できないので、optimizeはしない
+    # (必要ならmanage.py rebuild_search_indexで作り直す)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0001_tweet_index"),
+    ]
+
+    operations = [
+        # 戻す時は最後の1文字のトークンが残るだけで、検索結果は変わらないので何もしない
+        migrations.RunPython(reindex, migrations.RunPython.noop),
+    ]
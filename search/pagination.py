@@ -0,0 +1,33 @@
+from django.db import connections
+
+from tweets.pagination import CursorPaginator
+
+from .backends import get_backend
+from .tokenizer import tokenize
+
+
+class SearchPaginator(CursorPaginator):
+    """検索インデックスからqueryにマッチするツイートのidを1ページ分取り出し、querysetでツイート本体を取得する
+
+    検索結果はidの降順(新しい順)に並べる。querysetはvalues()のクエリセットでもよい(その場合はidを含めること)。
+    インデックスに残っていても削除済みのツイートは表示しないので、そのページの件数は少なくなる。
+    """
+
+    def __init__(self, queryset, query, per_page=20):
+        super().__init__(queryset, ("-id",), per_page)
+        self.tokens = tokenize(query, query=True)
+
+    def _fetch(self, queryset, fields, position, backwards):
+        if not self.tokens:
+            return []
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            ids = get_backend(connection).match_ids(
+                cursor, self.tokens, position[0] if position else None, backwards, self.per_page + 1
+            )
+        return [{"id": pk} for pk in ids]
+
+    def page(self, cursor=None):
+        page = super().page(cursor)
+        page.object_list = self.hydrate(self.queryset, [row["id"] for row in page.object_list])
+        return page
@@ -0,0 +1,11 @@
+from .index import index_tweets, unindex_tweets
+
+
+def index_saved_tweet(sender, instance, using, **kwargs):
+    """ツイートの作成・編集をインデックスに反映する(Tweetのpost_saveシグナルのレシーバー)"""
+    index_tweets([(instance.pk, instance.content)], using=using)
+
+
+def unindex_deleted_tweet(sender, instance, using, **kwargs):
+    """削除したツイートをインデックスから削除する(Tweetのpost_deleteシグナルのレシーバー)"""
+    unindex_tweets([instance.pk], using=using)
@@ -0,0 +1,116 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from tweets.models import Tweet
+
+from .pagination import SearchPaginator
+from .tokenizer import tokenize
+
+User = get_user_model()
+
+
+class TestTokenizer(TestCase):
+    def test_bigram(self):
+        self.assertEqual(tokenize("東京タワー"), ["東京", "京タ", "タワ", "ワー", "ー"])
+        self.assertEqual(tokenize("東京タワー", query=True), ["東京", "京タ", "タワ", "ワー"])
+
+    def test_words(self):
+        self.assertEqual(tokenize("Hello, Django 4.1!"), ["hello", "django", "4", "1"])
+
+    def test_normalize(self):
+        # 全角英数字・半角カナ・大文字は同じトークンになる
+        self.assertEqual(tokenize("ＤＪＡＮＧＯ ｶﾀｶﾅ"), tokenize("django カタカナ"))
+
+    def test_mixed(self):
+        self.assertEqual(tokenize("Djangoで人々"), ["django", "で人", "人々", "々"])
+
+
+class TestSearchIndex(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tokyo = Tweet.objects.create(user=self.user, content="東京タワーに行った")
+        self.kyoto = Tweet.objects.create(user=self.user, content="京都でDjangoの勉強会")
+
+    def search(self, query):
+        return set(SearchPaginator(Tweet.objects.all(), query).page())
+
+    def test_search(self):
+        self.assertEqual(self.search("東京"), {self.tokyo})
+        self.assertEqual(self.search("タワー"), {self.tokyo})
+        self.assertEqual(self.search("DJANGO 勉強"), {self.kyoto})
+        self.assertEqual(self.search("東京 勉強"), set())  # すべての語を含むものだけ
+
+    def test_single_character(self):
+        # 1文字の場合はその文字で始まるbigramに前方一致する
+        self.assertEqual(self.search("京"), {self.tokyo, self.kyoto})
+        self.assertEqual(self.search("都"), {self.kyoto})
+
+    def test_single_character_at_end_of_run(self):
+        # 連続の最後の文字で始まるbigramはないので、最後の1文字のトークンにマッチする
+        tweet = Tweet.objects.create(user=self.user, content="今日は東京")
+        self.assertEqual(self.search("京"), {self.tokyo, self.kyoto, tweet})
+        self.assertEqual(self.search("会"), {self.kyoto})
+
+    def test_empty_query(self):
+        self.assertEqual(self.search(" !? "), set())
+
+    def test_update_and_delete(self):
+        self.tokyo.content = "大阪城に行った"
+        self.tokyo.save()
+        self.assertEqual(self.search("東京"), set())
+        self.assertEqual(self.search("大阪"), {self.tokyo})
+        self.kyoto.delete()
+        self.assertEqual(self.search("django"), set())
+
+    def test_rebuild_command(self):
+        # bulk_createはシグナルを送らないので、作り直すまで検索できない
+        Tweet.objects.bulk_create([Tweet(user=self.user, content="名古屋城")])
+        self.assertEqual(self.search("名古屋"), set())
+        out = StringIO()
+        call_command("rebuild_search_index", "--batch-size", "2", stdout=out)
+        self.assertIn("3件", out.getvalue())
+        self.assertEqual(len(self.search("名古屋")), 1)
+        self.assertEqual(self.search("東京"), {self.tokyo})
+
+
+class TestSearchView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        Tweet.objects.bulk_create(Tweet(user=self.user, content="東京{}".format(i)) for i in range(25))
+        call_command("rebuild_search_index", stdout=StringIO())
+        Tweet.objects.create(user=self.user, content="大阪")
+
+    def test_success_get(self):
+        newest_first = list(Tweet.objects.filter(content__startswith="東京").order_by("-id"))
+        response = self.client.get(reverse("search:search"), {"q": "東京"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet_list"], newest_first[:20])
+        page = response.context["page_obj"]
+        self.assertTrue(page.has_next())
+        response = self.client.get(reverse("search:search"), {"q": "東京", "cursor": page.next_cursor})
+        self.assertEqual(response.context["tweet_list"], newest_first[20:])
+        page = response.context["page_obj"]
+        response = self.client.get(reverse("search:search"), {"q": "東京", "cursor": page.previous_cursor})
+        self.assertEqual(response.context["tweet_list"], newest_first[:20])
+
+    def test_without_query(self):
+        response = self.client.get(reverse("search:search"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["tweet_list"]), 0)
+
+    def test_failure_get_without_login(self):
+        self.client.logout()
+        response = self.client.get(reverse("search:search"), {"q": "東京"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_api(self):
+        response = self.client.get(reverse("search:api_search"), {"q": "大阪"})
+        self.assertEqual(response.status_code, 200)
+        tweets = response.json()["tweets"]
+        self.assertEqual([tweet["content"] for tweet in tweets], ["大阪"])
+        self.assertEqual(tweets[0]["username"], "testuser")
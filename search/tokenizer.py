@@ -0,0 +1,44 @@
+"""ツイート検索のトークナイザー
+
+日本語は単語の区切りがないので、ひらがな・カタカナ・漢字などの連続は2文字ずつ(bigram)に区切る。
+1文字の検索はその文字で始まるbigramに前方一致させる(backends.is_prefix)が、連続の最後の文字で始まるbigramは
+ないので、インデックスに入れる時は最後の文字も1文字のトークンにする。
+英数字などの連続は1つの単語にする。NFKCで正規化して小文字にするので、全角英数字や半角カナも同じトークンになる。
+
+    >>> tokenize("Djangoで東京タワー")
+    ['django', 'で東', '東京', '京タ', 'タワ', 'ワー', 'ー']
+    >>> tokenize("Djangoで東京タワー", query=True)
+    ['django', 'で東', '東京', '京タ', 'タワ', 'ワー']
+"""
+
+import re
+import unicodedata
+
+CJK = r"[々〆ぁ-ヿ㐀-䶿一-鿿豈-﫿가-힯]"
+TOKEN_RE = re.compile(r"{cjk}+|(?:(?!{cjk})[^\W_])+".format(cjk=CJK))
+CJK_RE = re.compile(CJK)
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def is_cjk(token):
+    return CJK_RE.match(token) is not None
+
+
+def tokenize(text, query=False):
+    """textのトークンを出現順に重複なしで返す
+
+    検索語(query=True)には最後の文字のトークンを付けない。2文字以上ならbigramだけで絞り込める。
+    """
+    tokens = {}
+    for run in TOKEN_RE.findall(normalize(text)):
+        if is_cjk(run) and len(run) > 1:
+            for i in range(len(run) - 1):
+                tokens[run[i : i + 2]] = None
+            if not query:
+                tokens[run[-1]] = None
+        else:
+            tokens[run] = None
+    return list(tokens)
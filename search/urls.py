@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = "search"
+
+urlpatterns = [
+    path("", views.SearchView.as_view(), name="search"),
+    path("api/", views.SearchApiView.as_view(), name="api_search"),
+]
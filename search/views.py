@@ -0,0 +1,33 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.generic import ListView
+
+from tweets.api import JsonApiView, tweet_values
+from tweets.models import Tweet
+from tweets.pagination import CursorPaginationMixin
+
+from .pagination import SearchPaginator
+
+
+class SearchView(LoginRequiredMixin, CursorPaginationMixin, ListView):
+    template_name = "search/search.html"
+    context_object_name = "tweet_list"
+
+    def get_query(self):
+        return self.request.GET.get("q", "").strip()
+
+    def get_queryset(self):
+        return Tweet.objects.with_engagement(self.request.user)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return SearchPaginator(queryset, self.get_query(), per_page)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.get_query()
+        return context
+
+
+class SearchApiView(JsonApiView):
+    def get_data(self):
+        queryset = tweet_values(Tweet.objects.all(), self.request.user)
+        return self.paginate(SearchPaginator(queryset, self.request.GET.get("q", ""), self.per_page))
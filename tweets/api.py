@@ -0,0 +1,100 @@
+"""ホームタイムライン・ユーザーのツイート・ツイート詳細のJSON API
+
+HTMLのビューと違ってモデルのインスタンスを作らず、values()で取得した辞書をそのままJSONにする。
+orjsonがインストールされていればorjsonでエンコードする。
+レスポンスにはボディのハッシュをETagとして付け、If-None-Matchが一致すれば304を返す。
+"""
+
+import hashlib
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django.views.generic import View
+
+from . import timeline
+from .models import Tweet
+from .pagination import CursorPaginator, InvalidCursor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+User = get_user_model()
+
+TWEET_FIELDS = ("id", "content", "created_at", "like_count", "is_liked")
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_UTC_Z)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def tweet_values(queryset, viewer):
+    """JSONにするツイートの辞書のクエリセット(投稿者はusernameだけ)"""
+    return queryset.with_engagement(viewer).values(*TWEET_FIELDS, username=F("user__username"))
+
+
+class JsonApiView(LoginRequiredMixin, View):
+    per_page = 20
+    cursor_kwarg = "cursor"
+
+    def get(self, request, *args, **kwargs):
+        try:
+            data = self.get_data()
+        except InvalidCursor:
+            return JsonResponse({"error": "不正なカーソルです"}, status=400)
+        return self.render_to_response(data)
+
+    def get_data(self):
+        raise NotImplementedError
+
+    def paginate(self, paginator):
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return {
+            "tweets": list(page.object_list),
+            "next_cursor": page.next_cursor,
+            "previous_cursor": page.previous_cursor,
+        }
+
+    def render_to_response(self, data):
+        body = dumps(data)
+        etag = quote_etag(hashlib.md5(body).hexdigest())
+        if etag in parse_etags(self.request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        # いいねしているかどうかがユーザーごとに違うので、共有キャッシュには保存させず毎回確認させる
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Cookie"])
+        return response
+
+
+class HomeTimelineApiView(JsonApiView):
+    def get_data(self):
+        queryset = tweet_values(Tweet.objects.all(), self.request.user)
+        return self.paginate(timeline.HomeTimelinePaginator(self.request.user, queryset, self.per_page))
+
+
+class UserTweetsApiView(JsonApiView):
+    def get_data(self):
+        user = get_object_or_404(User.objects.only("pk"), username=self.kwargs["username"])
+        queryset = tweet_values(Tweet.objects.filter(user=user), self.request.user)
+        return self.paginate(CursorPaginator(queryset, ("-created_at", "-id"), self.per_page))
+
+
+class TweetDetailApiView(JsonApiView):
+    def get_data(self):
+        tweet = tweet_values(Tweet.objects.filter(pk=self.kwargs["pk"]), self.request.user).first()
+        if tweet is None:
+            raise Http404("ツイートが見つかりません")
+        return {"tweet": tweet}
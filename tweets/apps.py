@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_save
 
 
 class TweetsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "tweets"
+
+    def ready(self):
+        from .stats import create_user_stats
+
+        post_save.connect(create_user_stats, sender=settings.AUTH_USER_MODEL, dispatch_uid="create_user_stats")
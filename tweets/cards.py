@@ -0,0 +1,20 @@
+"""ホーム・プロフィールに並べるツイートのテンプレートフラグメントキャッシュ
+
+ツイートの本文・投稿者・リンクは誰が見ても同じなので、ツイートごとにキャッシュして全ユーザーで共有する。
+いいねボタンは閲覧者がいいねしているかどうか(is_liked)の2通りだけをキャッシュし、いいね数は毎回描画する。
+キャッシュキーにはidに加えて作成日時を含め、削除されたツイートのidが再利用されても古い断片を返さないようにする。
+"""
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+FRAGMENTS = ("home_tweet", "profile_tweet", "profile_tweet_detail")  # テンプレートの{% cache %}の名前
+LIKE_FRAGMENT = "tweet_like"
+
+
+def invalidate(tweet):
+    """tweetのキャッシュされた断片をすべて削除する"""
+    version = [tweet.pk, tweet.created_at.timestamp()]
+    keys = [make_template_fragment_key(name, version) for name in FRAGMENTS]
+    keys += [make_template_fragment_key(LIKE_FRAGMENT, [*version, is_liked]) for is_liked in (True, False)]
+    cache.delete_many(keys)
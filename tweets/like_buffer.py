@@ -0,0 +1,129 @@
+"""いいねの書き込みをログに溜めて、まとめてDBに反映する(write-behind)
+
+settings.LIKE_WRITE_BEHINDがTrueの場合、いいね・いいね取り消しはDBに書き込まず、
+settings.LIKE_BUFFER_PATHの追記専用のログに(tweet_id, user_id, いいねするかどうか)を1行ずつ書いて
+すぐに楽観的ないいね数を返す。ログはflush()でまとめてDBに反映する。同じユーザーの同じツイートへの操作は
+最後のものだけを反映するので、いいねしてすぐ取り消した場合などはDBに書き込まれない。
+多くのユーザーにいいねされたツイートでもTweetの行の更新はflushごとに1回で済む。
+
+ログは複数のプロセスから追記できる(共有のストアの代わり)。flush()はログの名前を変えてから読み込み、
+反映し終わってから削除する。途中でプロセスが落ちても、名前を変えたログは次のflush()で読み込み直す。
+ログにはいいねの差分ではなく状態を書いているので、同じログを2回反映しても結果は変わらない。
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .likes import apply_like_changes
+from .models import Like, Tweet
+
+logger = logging.getLogger(__name__)
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def log_path():
+    return Path(settings.LIKE_BUFFER_PATH)
+
+
+def append(entries):
+    """ログに追記する。flush()が名前を変えた後のログには書き込まないよう、ロックを取ってから確認する
+
+    書き込み途中で落ちた行が末尾に残っていると、次の行がつながって一緒に読み飛ばされるので、改行してから書く。
+    """
+    path = log_path()
+    data = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if path.exists() and os.fstat(fd).st_ino == os.stat(path).st_ino:
+                size = os.fstat(fd).st_size
+                if size and os.pread(fd, 1, size - 1) != b"\n":
+                    data = b"\n" + data
+                os.write(fd, data)
+                return
+        finally:
+            os.close(fd)  # ロックも外れる
+
+
+def record(user, operations):
+    """{tweet_id: いいねするかどうか}をログに書き、{tweet_id: 楽観的ないいね数}を返す
+
+    いいね数はDBのlike_countにこの操作の分を足したもので、まだ反映していない他の操作は含まない。
+    存在しないツイートへの操作はログに書かない。
+    """
+    like_counts = dict(Tweet.objects.filter(pk__in=operations).values_list("pk", "like_count"))
+    liked = set(Like.objects.filter(user=user, tweet_id__in=like_counts).values_list("tweet_id", flat=True))
+    if like_counts:
+        append({"tweet_id": pk, "user_id": user.pk, "liked": operations[pk]} for pk in like_counts)
+    for pk in like_counts:
+        if operations[pk] and pk not in liked:
+            like_counts[pk] += 1
+        elif not operations[pk] and pk in liked:
+            like_counts[pk] = max(like_counts[pk] - 1, 0)
+    ensure_flusher()
+    return like_counts
+
+
+def flush():
+    """ログをDBに反映し、反映した操作の数を返す"""
+    path = log_path()
+    # flush()は同時に1つしか実行しない
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if path.exists():
+            with open(path, "a") as log:
+                fcntl.flock(log, fcntl.LOCK_EX)  # 書き込み中の行がなくなるのを待つ
+                path.rename(path.with_name("{}.{}.flushing".format(path.name, time.time_ns())))
+
+        # 前回反映し終わる前に落ちたログも古い順に読み込み、後の操作で上書きする
+        pending = sorted(path.parent.glob(path.name + ".*.flushing"))
+        changes = {}
+        for pending_path in pending:
+            with open(pending_path) as log:
+                for line in log:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # 書き込み途中で落ちた行
+                        logger.warning("いいねのログの壊れた行を読み飛ばしました: %r", line)
+                        continue
+                    changes[(entry["tweet_id"], entry["user_id"])] = entry["liked"]
+        if changes:
+            apply_like_changes(changes)
+        for pending_path in pending:
+            pending_path.unlink()
+        return len(changes)
+
+
+def run_flusher(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            # ログは残っているので、次のflush()でもう一度反映する
+            logger.exception("いいねのログを反映できませんでした")
+        finally:
+            close_old_connections()
+
+
+def ensure_flusher():
+    """settings.LIKE_FLUSH_INTERVALごとにflush()するスレッドを、このプロセスで動いていなければ起動する"""
+    global _flusher
+    interval = settings.LIKE_FLUSH_INTERVAL
+    if interval is None or (_flusher is not None and _flusher.is_alive()):
+        return
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=run_flusher, args=(interval,), name="like-flusher", daemon=True)
+            _flusher.start()
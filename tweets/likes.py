@@ -0,0 +1,138 @@
+"""いいねの書き込み
+
+いいねの追加・取り消しと、Tweet.like_count、ユーザーごとのいいね数(stats.py)とトレンドのスコア(trending.py)の更新を
+同じトランザクションで行う。
+"""
+
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.http import Http404
+
+from . import stats, trending, versions
+from .models import Like, Tweet
+
+User = get_user_model()
+
+
+def get_like_count_or_404(tweet_id):
+    """(いいね数, 投稿者のid)を返す"""
+    row = Tweet.objects.filter(pk=tweet_id).values_list("like_count", "user_id").first()
+    if row is None:
+        raise Http404("ツイートが見つかりません")
+    return row
+
+
+def bump_versions(author_ids, user_ids):
+    """いいね数が変わったツイートの投稿者と、いいねを変更したユーザーのページのバージョンを更新する"""
+    if author_ids:
+        versions.bump("tweets", *author_ids)
+    if user_ids:
+        versions.bump("likes", *user_ids)
+
+
+def add_like(tweet_id, user):
+    """いいねを追加し、いいね数を返す
+
+    ツイートを先に取得せず、INSERT ... ON CONFLICT DO NOTHING、like_countのUPDATE、いいね数のSELECTと
+    トレンドのスコアの更新を1つのトランザクションで実行する。ツイートが存在しなければ追加したいいねごとロールバックする。
+    """
+    with transaction.atomic():  # いいねの追加とlike_countの更新を同じトランザクションで行う
+        created = Like.objects.create_or_ignore(tweet_id=tweet_id, user=user)  # created_atはINSERTの時に入る
+        if created:
+            if not Tweet.objects.filter(pk=tweet_id).update(like_count=F("like_count") + 1):
+                raise Http404("ツイートが見つかりません")
+        like_count, author_id = get_like_count_or_404(tweet_id)
+        if created:
+            stats.record_likes([(user.pk, author_id, 1)])
+            trending.record_likes({tweet_id: [created.created_at]})
+            bump_versions([author_id], [user.pk])
+        return like_count
+
+
+def remove_like(tweet_id, user):
+    """いいねを取り消し、いいね数を返す(いいねした時刻のSELECT、DELETE、like_countのUPDATE、いいね数のSELECT)"""
+    with transaction.atomic():
+        likes = Like.objects.filter(user=user, tweet_id=tweet_id)
+        # トレンドのスコアからいいねした時刻の重みを引くので、削除する前に読んでおく
+        liked_at = list(likes.values_list("created_at", flat=True))
+        deleted, _ = likes.delete() if liked_at else (0, None)
+        if deleted:  # カウンタがずれていても負の値にはしない
+            Tweet.objects.filter(pk=tweet_id, like_count__gte=deleted).update(like_count=F("like_count") - deleted)
+        like_count, author_id = get_like_count_or_404(tweet_id)
+        if deleted:
+            stats.record_likes([(user.pk, author_id, -deleted)])
+            trending.record_likes(removed={tweet_id: liked_at})
+            bump_versions([author_id], [user.pk])
+        return like_count
+
+
+def apply_likes(user, operations):
+    """{tweet_id: いいねするかどうか}をまとめて反映し、{tweet_id: いいね数}を返す
+
+    ツイートの数によらず一定回数のクエリで済む。存在しないツイートへの操作は無視する。
+    """
+    return apply_like_changes({(tweet_id, user.pk): liked for tweet_id, liked in operations.items()})
+
+
+def apply_like_changes(changes):
+    """{(tweet_id, user_id): いいねするかどうか}をまとめて反映し、{tweet_id: いいね数}を返す
+
+    いいねの追加はbulk_create、取り消しはユーザーごとのDELETEで行い、like_countは増減の値ごとに
+    まとめてUPDATEする。多くのユーザーにいいねされたツイートでも行の更新は1回で済む。
+    いいねするかどうかは差分ではなく状態なので、同じchangesを何度反映しても結果は変わらない。
+    like_buffer.flush()ではログに書いた後にツイートやユーザーが削除されていることがあるので、
+    存在しないツイート・ユーザーへの操作は無視する(外部キーの制約でコミットに失敗しないように)。
+    """
+    with transaction.atomic():
+        tweet_ids = set(Tweet.objects.filter(pk__in={pk for pk, _ in changes}).values_list("pk", flat=True))
+        user_ids = set(User.objects.filter(pk__in={pk for _, pk in changes}).values_list("pk", flat=True))
+        liked = {
+            (tweet_id, user_id): created_at
+            for tweet_id, user_id, created_at in Like.objects.filter(
+                tweet_id__in=tweet_ids, user_id__in=user_ids
+            ).values_list("tweet_id", "user_id", "created_at")
+        }
+        deltas = defaultdict(int)
+        added_times = defaultdict(list)  # トレンドのスコアに足す・引くいいねの時刻
+        removed_times = defaultdict(list)
+        user_deltas = []  # (user_id, tweet_id, 増減)
+        added = []
+        removed = defaultdict(list)
+        changed_user_ids = set()
+        for (tweet_id, user_id), like in changes.items():
+            if tweet_id not in tweet_ids or user_id not in user_ids or like == ((tweet_id, user_id) in liked):
+                continue
+            if like:
+                added.append(Like(tweet_id=tweet_id, user_id=user_id))
+                deltas[tweet_id] += 1
+            else:
+                removed[user_id].append(tweet_id)
+                deltas[tweet_id] -= 1
+                removed_times[tweet_id].append(liked[tweet_id, user_id])
+            user_deltas.append((user_id, tweet_id, 1 if like else -1))
+            changed_user_ids.add(user_id)
+
+        Like.objects.bulk_create(added, ignore_conflicts=True)  # created_atは保存した値がインスタンスにも入る
+        for like in added:
+            added_times[like.tweet_id].append(like.created_at)
+        for user_id, removed_tweet_ids in removed.items():
+            Like.objects.filter(user_id=user_id, tweet_id__in=removed_tweet_ids).delete()
+
+        tweets_by_delta = defaultdict(list)
+        for tweet_id, delta in deltas.items():
+            if delta:
+                tweets_by_delta[delta].append(tweet_id)
+        for delta, delta_tweet_ids in tweets_by_delta.items():
+            # カウンタがずれていても負の値にはしない
+            Tweet.objects.filter(pk__in=delta_tweet_ids, like_count__gte=-delta).update(
+                like_count=F("like_count") + delta
+            )
+        trending.record_likes(added_times, removed_times)
+        rows = Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", "like_count", "user_id")
+        author_ids = {pk: author_id for pk, _, author_id in rows}
+        stats.record_likes((user_id, author_ids[tweet_id], delta) for user_id, tweet_id, delta in user_deltas)
+        bump_versions({author_id for pk, _, author_id in rows if deltas.get(pk)}, changed_user_ids)
+        return {pk: like_count for pk, like_count, _ in rows}
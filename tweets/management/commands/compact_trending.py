@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import trending
+
+
+class Command(BaseCommand):
+    help = "トレンドのスコアから古いものと上位TRENDING_MAX_ENTRIES件に入らないものを削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="指定すると終了せず、この秒数ごとに削除し続ける")
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="いいねの時刻からスコアを計算し直す(bulk_createでいいねを追加した後など)",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            count = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS("{}件のツイートのスコアを計算し直しました".format(count)))
+        while True:
+            deleted = trending.compact()
+            self.stdout.write(self.style.SUCCESS("{}件のスコアを削除しました".format(deleted)))
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
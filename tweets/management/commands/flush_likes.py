@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import like_buffer
+
+
+class Command(BaseCommand):
+    help = "LIKE_WRITE_BEHINDで溜めたいいねのログをDBに反映する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="指定すると終了せず、この秒数ごとに反映し続ける")
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = like_buffer.flush()
+            self.stdout.write(self.style.SUCCESS("{}件のいいねを反映しました".format(flushed)))
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
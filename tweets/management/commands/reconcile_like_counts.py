@@ -0,0 +1,24 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from tweets import versions
+from tweets.management.reconcile import ReconcileCommand
+from tweets.models import Like, Tweet
+
+
+class Command(ReconcileCommand):
+    help = "Tweet.like_countをLikeテーブルの実際の件数に合わせて修正する"
+    drifted_message = "{}件のいいね数がずれています"
+    fixed_message = "{}件のいいね数を修正しました"
+
+    def get_drifted_ids(self, options):
+        return (
+            Tweet.objects.annotate(actual=Count("liked_tweet"))
+            .exclude(like_count=F("actual"))
+            .values_list("pk", flat=True)
+        )
+
+    def fix(self, ids):
+        actual = Like.objects.filter(tweet=OuterRef("pk")).values("tweet").annotate(n=Count("pk")).values("n")
+        Tweet.objects.filter(pk__in=ids).update(like_count=Coalesce(Subquery(actual), 0))
+        versions.bump("tweets", *set(Tweet.objects.filter(pk__in=ids).values_list("user_id", flat=True)))
@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F, Q
+
+from tweets import stats, versions
+from tweets.management.reconcile import ReconcileCommand
+from tweets.models import UserStats
+
+User = get_user_model()
+
+
+class Command(ReconcileCommand):
+    help = "UserStatsの行がないユーザーの行を作り、ツイート数・いいね数・最後にツイートした日時を実際の値に合わせて修正する"
+    drifted_message = "{}人のツイート数・いいね数がずれています"
+
+    def get_drifted_ids(self, options):
+        self.missing_ids = list(User.objects.filter(stats__isnull=True).values_list("pk", flat=True))
+        if not options["dry_run"]:
+            UserStats.objects.bulk_create(
+                (UserStats(user_id=pk) for pk in self.missing_ids),
+                batch_size=options["batch_size"],
+                ignore_conflicts=True,
+            )
+
+        annotations = {"actual_" + field: value for field, value in stats.actual_values().items()}
+        drifted = Q()
+        for field in stats.COUNTERS:
+            drifted |= ~Q(**{field: F("actual_" + field)})
+        # NULL同士は一致とみなす
+        drifted |= Q(last_tweet_at__isnull=True, actual_last_tweet_at__isnull=False)
+        drifted |= Q(last_tweet_at__isnull=False, actual_last_tweet_at__isnull=True)
+        drifted |= Q(last_tweet_at__lt=F("actual_last_tweet_at")) | Q(last_tweet_at__gt=F("actual_last_tweet_at"))
+        drifted_ids = set(UserStats.objects.annotate(**annotations).filter(drifted).values_list("pk", flat=True))
+        if options["dry_run"]:
+            drifted_ids.update(self.missing_ids)
+        return sorted(drifted_ids)
+
+    def fix(self, ids):
+        UserStats.objects.filter(pk__in=ids).update(**stats.actual_values())
+        versions.bump("tweets", *ids)
+
+    def get_fixed_message(self, fixed):
+        return "{}人の行を作成し、{}人のツイート数・いいね数を修正しました".format(len(self.missing_ids), fixed)
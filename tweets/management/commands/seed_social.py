@@ -0,0 +1,157 @@
+import random
+from array import array
+from io import StringIO
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Friendship
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+def bulk_insert(model, rows, batch_size):
+    """ジェネレーターからbatch_size件ずつ取り出して保存する(bulk_createは全件をリストにしてしまうため)"""
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def power_law_index(rng, n, skew):
+    """0〜n-1を返す。skewが大きいほど0に近い値(人気のあるユーザー・ツイート)に偏る"""
+    return int(n * rng.random() ** skew)
+
+
+def split(total, n, start, end):
+    """total件をn人に均等に割り振った時の[start, end)の人の分の件数"""
+    return total * end // n - total * start // n
+
+
+class Command(BaseCommand):
+    help = "負荷試験用のユーザー・フォロー・ツイート・いいねを大量に生成する(同じ--seedなら同じデータになり、途中から再開できる)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--tweets", type=int, default=10000, help="全ユーザーのツイートの合計")
+        parser.add_argument("--likes", type=int, default=20000, help="全ユーザーのいいねの合計")
+        parser.add_argument("--follows", type=int, default=20, help="1人あたりの平均フォロー数")
+        parser.add_argument("--skew", type=float, default=3.0, help="フォローやいいねが一部に集中する度合い")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", default="seed", help="生成するユーザー名の接頭辞")
+        parser.add_argument("--password", default="password", help="全ユーザー共通のパスワード")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.batch_size = options["batch_size"]
+
+        self.create_users()
+        self.user_ids = array(
+            "q",
+            User.objects.filter(username__startswith=options["prefix"])
+            .order_by("username")
+            .values_list("pk", flat=True)
+            .iterator(),
+        )
+        self.each_chunk("follow", Friendship, "follower_id__in", self.friendships)
+        call_command("reconcile_follow_counts", stdout=StringIO())
+        self.each_chunk("tweet", Tweet, "user_id__in", self.tweets)
+        self.each_chunk("timeline", TimelineEntry, "tweet__user_id__in", self.timeline_entries)
+        self.tweet_ids = array(
+            "q", Tweet.objects.filter(user_id__in=self.user_ids).order_by("pk").values_list("pk", flat=True).iterator()
+        )
+        self.each_chunk("like", Like, "user_id__in", self.likes)
+        call_command("reconcile_like_counts", stdout=StringIO())
+        call_command("reconcile_user_stats", stdout=StringIO())
+        call_command("compact_trending", "--rebuild", stdout=StringIO())
+        call_command("rebuild_search_index", stdout=StringIO())  # bulk_createはシグナルを送らないため
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "ユーザー{}人、ツイート{}件のデータを生成しました".format(len(self.user_ids), len(self.tweet_ids))
+            )
+        )
+
+    def username(self, i):
+        return "{}{:08d}".format(self.options["prefix"], i)
+
+    def create_users(self):
+        total = self.options["users"]
+        # チャンクごとにコミットしているので、作成済みの人数から再開できる
+        start = User.objects.filter(username__startswith=self.options["prefix"]).count()
+        password = make_password(self.options["password"])  # ユーザーごとにハッシュ化すると遅いので使い回す
+        for chunk_start in range(start, total, self.batch_size):
+            chunk = range(chunk_start, min(chunk_start + self.batch_size, total))
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    User(username=self.username(i), email="{}@example.com".format(self.username(i)), password=password)
+                    for i in chunk
+                )
+        self.stdout.write("user: {}/{}".format(total, total))
+
+    def each_chunk(self, name, model, lookup, generate):
+        """ユーザーをbatch_size人ずつに分けてgenerateの生成した行を保存する
+
+        乱数はチャンクごとに(seed, name, チャンク番号)から作るので、途中のチャンクから再開しても
+        最初から実行した場合と同じデータになる。行が1件でもあるチャンクは作成済みとして飛ばす。
+        """
+        n = len(self.user_ids)
+        for number, start in enumerate(range(0, n, self.batch_size)):
+            end = min(start + self.batch_size, n)
+            chunk_ids = self.user_ids[start:end]
+            if model.objects.filter(**{lookup: chunk_ids}).exists():
+                continue
+            rng = random.Random("{}:{}:{}".format(self.options["seed"], name, number))
+            with transaction.atomic():
+                bulk_insert(model, generate(rng, start, end), self.batch_size)
+            self.stdout.write("{}: {}/{}".format(name, end, n))
+
+    def friendships(self, rng, start, end):
+        n = len(self.user_ids)
+        for i in range(start, end):
+            followings = {
+                power_law_index(rng, n, self.options["skew"])
+                for _ in range(rng.randint(0, 2 * self.options["follows"]))
+            }
+            followings.discard(i)
+            for j in sorted(followings):
+                yield Friendship(follower_id=self.user_ids[i], following_id=self.user_ids[j])
+
+    def tweets(self, rng, start, end):
+        for _ in range(split(self.options["tweets"], len(self.user_ids), start, end)):
+            user_id = self.user_ids[rng.randrange(start, end)]
+            yield Tweet(user_id=user_id, content="seed tweet {}".format(rng.getrandbits(32)))
+
+    def timeline_entries(self, rng, start, end):
+        # フォロワーの多いユーザーはツイート作成時にも書き込まないので、timeline.fan_outと同じく除外する
+        authors = User.objects.filter(
+            pk__in=self.user_ids[start:end], follower_count__lte=settings.TIMELINE_FANOUT_THRESHOLD
+        )
+        followers = {}
+        for following_id, follower_id in Friendship.objects.filter(following__in=authors).values_list(
+            "following_id", "follower_id"
+        ):
+            followers.setdefault(following_id, []).append(follower_id)
+        # 書き込む前にチャンク分のツイートを取り出しておく(理由はtweets/management/reconcile.pyと同じ)
+        tweets = list(Tweet.objects.filter(user__in=authors).values_list("pk", "user_id", "created_at"))
+        for tweet_id, user_id, created_at in tweets:
+            for owner_id in followers.get(user_id, ()):
+                yield TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created_at=created_at)
+
+    def likes(self, rng, start, end):
+        n = len(self.tweet_ids)
+        if not n:
+            return
+        pairs = set()
+        for _ in range(split(self.options["likes"], len(self.user_ids), start, end)):
+            # 新しいツイートほどいいねされやすくする
+            tweet_id = self.tweet_ids[n - 1 - power_law_index(rng, n, self.options["skew"])]
+            pairs.add((tweet_id, self.user_ids[rng.randrange(start, end)]))
+        for tweet_id, user_id in sorted(pairs):
+            yield Like(tweet_id=tweet_id, user_id=user_id)
@@ -0,0 +1,46 @@
+"""非正規化したカウンタを実際の値に合わせるコマンド(reconcile_*)の共通部分"""
+
+from django.core.management.base import BaseCommand
+
+
+class ReconcileCommand(BaseCommand):
+    """get_drifted_ids()でずれている行のidを求め、batch_size件ずつfix()で修正する
+
+    --dry-runでは修正せずに、ずれている件数をdrifted_messageで表示する。修正した後はfixed_messageで表示する。
+    """
+
+    drifted_message = None  # {}にずれている件数が入る
+    fixed_message = None  # {}に修正した件数が入る
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="修正せずにずれている件数だけ表示する")
+
+    def get_drifted_ids(self, options):
+        """実際の値とずれている行のidを返す"""
+        raise NotImplementedError
+
+    def fix(self, ids):
+        """idsの行を実際の値に合わせ、その行を表示するページのバージョンを更新する"""
+        raise NotImplementedError
+
+    def get_fixed_message(self, fixed):
+        return self.fixed_message.format(fixed)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        # SQLiteは読み込み中のテーブルへの書き込みが安全でないため、先にidだけ取り出しておく
+        drifted_ids = list(self.get_drifted_ids(options))
+
+        fixed = 0
+        for start in range(0, len(drifted_ids), batch_size):
+            batch = drifted_ids[start : start + batch_size]
+            if not options["dry_run"]:
+                # fix()は集計時点の値ではなく、更新する瞬間の値をサブクエリで求め直して書き込む
+                self.fix(batch)
+            fixed += len(batch)
+
+        if options["dry_run"]:
+            self.stdout.write(self.drifted_message.format(fixed))
+        else:
+            self.stdout.write(self.style.SUCCESS(self.get_fixed_message(fixed)))
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_timelineentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingTweet",
+            fields=[
+                (
+                    "tweet",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trending",
+                        serialize=False,
+                        to="tweets.tweet",
+                    ),
+                ),
+                ("score", models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="trendingtweet",
+            index=models.Index(fields=["score", "tweet"], name="trending_score_idx"),
+        ),
+    ]
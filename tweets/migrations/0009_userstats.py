@@ -0,0 +1,58 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_user_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Tweet = apps.get_model("tweets", "Tweet")
+    Like = apps.get_model("tweets", "Like")
+    UserStats = apps.get_model("tweets", "UserStats")
+
+    def count(queryset, field):
+        rows = queryset.filter(**{field: OuterRef("pk")}).values(field).annotate(n=Count("pk"))
+        return Coalesce(Subquery(rows.values("n")), 0)
+
+    user_ids = User.objects.values_list("pk", flat=True)
+    UserStats.objects.bulk_create((UserStats(user_id=pk) for pk in user_ids.iterator()), batch_size=1000)
+    UserStats.objects.update(
+        tweet_count=count(Tweet.objects.all(), "user"),
+        like_given_count=count(Like.objects.all(), "user"),
+        like_received_count=count(Like.objects.all(), "tweet__user"),
+        last_tweet_at=Subquery(Tweet.objects.filter(user=OuterRef("pk")).order_by("-created_at").values("created_at")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_friendship_unique_and_indexes"),
+        ("tweets", "0008_trendingtweet"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("tweet_count", models.PositiveIntegerField(default=0)),
+                ("like_given_count", models.PositiveIntegerField(default=0)),
+                ("like_received_count", models.PositiveIntegerField(default=0)),
+                ("last_tweet_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(populate_user_stats, migrations.RunPython.noop),
+    ]
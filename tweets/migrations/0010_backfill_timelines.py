@@ -0,0 +1,58 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_timelines(apps, schema_editor):
+    """既存のフォローについて、timeline.backfillと同じくフォローしているユーザーの最近のツイートをタイムラインに追加する
+
+    0007でTimelineEntryを作った時点のフォローはタイムラインが空のままで、ホームに自分とフォロワーの多い
+    ユーザーのツイートしか表示されないため。フォロワーの多いユーザーは表示時に取得するので追加しない。
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Friendship = apps.get_model("accounts", "Friendship")
+    Tweet = apps.get_model("tweets", "Tweet")
+    TimelineEntry = apps.get_model("tweets", "TimelineEntry")
+    alias = schema_editor.connection.alias
+
+    # 書き込む前にidだけ取り出しておく(理由はtweets/management/reconcile.pyと同じ)
+    author_ids = list(
+        User.objects.using(alias)
+        .filter(follower_count__lte=settings.TIMELINE_FANOUT_THRESHOLD, follower__isnull=False)
+        .distinct()
+        .values_list("pk", flat=True)
+    )
+    for author_id in author_ids:
+        tweets = list(
+            Tweet.objects.using(alias)
+            .filter(user_id=author_id)
+            .order_by("-created_at", "-id")
+            .values_list("pk", "created_at")[: settings.TIMELINE_BACKFILL_SIZE]
+        )
+        if not tweets:
+            continue
+        follower_ids = list(
+            Friendship.objects.using(alias).filter(following_id=author_id).values_list("follower_id", flat=True)
+        )
+        entries = (
+            TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created_at=created_at)
+            for owner_id in follower_ids
+            for tweet_id, created_at in tweets
+        )
+        while batch := list(islice(entries, BATCH_SIZE)):
+            TimelineEntry.objects.using(alias).bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_friendship_unique_and_indexes"),
+        ("tweets", "0009_userstats"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,60 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import sql
+from django.db.models.constants import OnConflict
 
 User = get_user_model()
 
 
+class TweetQuerySet(models.QuerySet):
+    def with_engagement(self, viewer):
+        """投稿者、いいね数、viewerがいいねしているかどうか(is_liked)を1回のクエリで取得する
+
+        いいね数はlike_countカラムに非正規化してあるので集計は不要。
+        """
+        queryset = self.select_related("user")
+        if not viewer.is_authenticated:
+            return queryset.annotate(is_liked=models.Value(False))
+        return queryset.annotate(is_liked=models.Exists(Like.objects.filter(tweet=models.OuterRef("pk"), user=viewer)))
+
+
 class Tweet(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # 1対多のリレーション
     content = models.TextField(max_length=140)
     created_at = models.DateTimeField(auto_now_add=True)  # モデルの保存時に時刻・日付を保存
+    like_count = models.PositiveIntegerField(default=0)  # LikeView/UnlikeViewで増減させる非正規化カラム
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="tweet_created_at_id_idx"),  # タイムラインのカーソル用
+            models.Index(fields=["user", "created_at", "id"], name="tweet_user_created_at_id_idx"),
+        ]
+
+    objects = TweetQuerySet.as_manager()
 
     def __str__(self):
         return self.content  # 管理画面でデータの判別をしやすくする(つけないと中身の判別ができない)
 
 
+class LikeQuerySet(models.QuerySet):
+    def create_or_ignore(self, **kwargs):
+        """INSERT ... ON CONFLICT DO NOTHINGで1件追加し、追加したインスタンスを返す(追加できなければNone)
+
+        get_or_createのように先にSELECTせず、重複はunique_like制約で防ぐ。
+        bulk_create(ignore_conflicts=True)は追加できたかどうかを返さないので、InsertQueryを直接実行する。
+        """
+        self._for_write = True
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        query = sql.InsertQuery(self.model, on_conflict=OnConflict.IGNORE)
+        obj = self.model(**kwargs)
+        query.insert_values(fields, [obj])
+        compiler = query.get_compiler(using=self.db)
+        with compiler.connection.cursor() as cursor:
+            for statement, params in compiler.as_sql():
+                cursor.execute(statement, params)
+            return obj if cursor.rowcount > 0 else None
+
+
 class Like(models.Model):
     tweet = models.ForeignKey(
         Tweet,
@@ -22,5 +64,42 @@ class Like(models.Model):
     user = models.ForeignKey(User, related_name="liked_user", on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = LikeQuerySet.as_manager()
+
     class Meta:
         constraints = [models.UniqueConstraint(fields=["tweet", "user"], name="unique_like")]
+
+
+class UserStats(models.Model):
+    """ユーザーごとのツイート数・いいね数・最後にツイートした日時(tweets/stats.py)
+
+    ツイートの作成・削除、いいね・いいね取り消しと同じトランザクションで増減させる非正規化テーブル。
+    """
+
+    user = models.OneToOneField(User, primary_key=True, related_name="stats", on_delete=models.CASCADE)
+    tweet_count = models.PositiveIntegerField(default=0)
+    like_given_count = models.PositiveIntegerField(default=0)  # いいねした数
+    like_received_count = models.PositiveIntegerField(default=0)  # 自分のツイートがいいねされた数
+    last_tweet_at = models.DateTimeField(null=True, blank=True)
+
+
+class TrendingTweet(models.Model):
+    """最近いいねされたツイートを時間減衰したスコアで並べるトレンド(tweets/trending.py)"""
+
+    tweet = models.OneToOneField(Tweet, primary_key=True, related_name="trending", on_delete=models.CASCADE)
+    score = models.FloatField()  # log2(Σ 2^((いいねの時刻 - EPOCH) / 半減期))
+
+    class Meta:
+        indexes = [models.Index(fields=["score", "tweet"], name="trending_score_idx")]
+
+
+class TimelineEntry(models.Model):
+    """フォローしているユーザーのツイートを、ツイート作成時に各フォロワーへ書き込んでおくホームタイムライン"""
+
+    owner = models.ForeignKey(User, related_name="timeline_entries", on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, related_name="timeline_entries", on_delete=models.CASCADE)
+    created_at = models.DateTimeField()  # tweet.created_atのコピー(タイムラインの並び順に使う)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry")]
+        indexes = [models.Index(fields=["owner", "created_at", "tweet"], name="timeline_owner_created_at_idx")]
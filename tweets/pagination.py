@@ -0,0 +1,169 @@
+import base64
+import binascii
+import datetime
+import json
+import math
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+# SQLiteのINTEGERとPostgreSQLのbigintに入る整数の範囲
+MIN_INTEGER, MAX_INTEGER = -(2**63), 2**63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def is_valid_position_value(value):
+    """カーソルの値をクエリに使えるかどうか(NULLや範囲外の整数、無限大はクエリの実行時にエラーになる)"""
+    if value is None:
+        return False
+    if isinstance(value, int):
+        return MIN_INTEGER <= value <= MAX_INTEGER
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return True
+
+
+class CursorPage:
+    """CursorPaginatorが返す1ページ分の結果"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor  # より古い側のページ
+        self.previous_cursor = previous_cursor  # より新しい側のページ
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """(created_at, id)のような並び順のキーでページを切り出すキーセットページネーション
+
+    OFFSETを使わず、直前のページの端の値より後ろの行をインデックスで探すため、
+    何ページ目でも1ページ目と同じコストで取得できる。
+    add_sourceで並び順のキーが同じ型の別クエリセットを追加すると、それぞれから
+    1ページ分ずつ取得してマージする。
+    """
+
+    def __init__(self, queryset, ordering=("-created_at", "-id"), per_page=20):
+        self.per_page = per_page
+        self.descending = ordering[0].startswith("-")
+        self.sources = []
+        self.add_source(queryset, ordering)
+
+    @property
+    def queryset(self):
+        return self.sources[0][0]
+
+    @property
+    def fields(self):
+        return self.sources[0][1]
+
+    def add_source(self, queryset, ordering):
+        if {name.startswith("-") for name in ordering} != {self.descending}:
+            raise ImproperlyConfigured("CursorPaginatorのorderingは全て同じ向きで指定してください")
+        if self.sources and len(ordering) != len(self.fields):
+            raise ImproperlyConfigured("追加するソースのorderingは同じ長さで指定してください")
+        self.sources.append((queryset, [name.lstrip("-") for name in ordering]))
+
+    def page(self, cursor=None):
+        position, backwards = self.decode_cursor(cursor) if cursor else (None, False)
+        rows = {}
+        for queryset, fields in self.sources:
+            for row in self._fetch(queryset, fields, position, backwards):
+                rows.setdefault(tuple(self.position(row, fields)), row)
+        keys = sorted(rows, reverse=self.descending != backwards)
+        has_more = len(keys) > self.per_page
+        keys = keys[: self.per_page]
+        if backwards:
+            keys.reverse()
+
+        next_cursor = previous_cursor = None
+        if keys:
+            if has_more or backwards:
+                next_cursor = self.encode_cursor(keys[-1])
+            if (has_more and backwards) or (position is not None and not backwards):
+                previous_cursor = self.encode_cursor(keys[0], backwards=True)
+        return CursorPage([rows[key] for key in keys], next_cursor, previous_cursor)
+
+    def hydrate(self, queryset, ids):
+        """querysetからidsの行を1回のクエリで取得し、idsの順に並べて返す(存在しない行は除く)
+
+        並び順のキーだけのページから本体を取得するサブクラスで使う。querysetはvalues()のクエリセットでもよい
+        (その場合はidを含めること)。
+        """
+        rows = {row["id"] if isinstance(row, dict) else row.pk: row for row in queryset.filter(pk__in=ids)}
+        return [rows[pk] for pk in ids if pk in rows]
+
+    def encode_cursor(self, position, backwards=False):
+        values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in position]
+        payload = json.dumps({"p": values, "b": backwards}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            values = payload["p"]
+            if len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            opts = self.queryset.model._meta
+            position = [opts.get_field(name).to_python(value) for name, value in zip(self.fields, values)]
+            if not all(is_valid_position_value(value) for value in position):
+                raise InvalidCursor(cursor)
+            return position, bool(payload.get("b"))
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+
+    def position(self, obj, fields=None):
+        if isinstance(obj, dict):  # values()のクエリセット
+            return [obj[name] for name in fields or self.fields]
+        return [getattr(obj, name) for name in fields or self.fields]
+
+    def _fetch(self, queryset, fields, position, backwards):
+        if position is not None:
+            queryset = queryset.filter(self._seek(fields, position, backwards))
+        prefix = "-" if self.descending != backwards else ""
+        return queryset.order_by(*[prefix + name for name in fields])[: self.per_page + 1]
+
+    def _seek(self, fields, position, backwards):
+        # (a, b) < (x, y) を a < x OR (a = x AND b < y) に展開する
+        lookup = "gt" if self.descending == backwards else "lt"
+        condition = Q()
+        for i, name in enumerate(fields):
+            equal = {field: value for field, value in zip(fields[:i], position[:i])}
+            condition |= Q(**equal, **{"{}__{}".format(name, lookup): position[i]})
+        return condition
+
+
+class CursorPaginationMixin:
+    """ListViewのページネーションをCursorPaginatorに差し替える"""
+
+    paginate_by = 20
+    cursor_ordering = ("-created_at", "-id")
+    cursor_kwarg = "cursor"
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return CursorPaginator(queryset, self.cursor_ordering, per_page)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404("不正なカーソルです")
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,124 @@
+"""ユーザーごとのツイート数・いいね数・最後にツイートした日時(UserStats)の更新
+
+プロフィールを表示するたびにツイートやいいねをCOUNT(*)しないよう、ツイートの作成・削除と
+いいね・いいね取り消し(likes.py)と同じトランザクションでUserStatsを増減させる。
+行はユーザーを作った時にシグナルで作る。bulk_createで作ったユーザーなど行がないユーザーは
+0から数え始めるので、manage.py reconcile_user_statsで実際の件数に合わせる。
+"""
+
+from collections import defaultdict
+
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Like, Tweet, UserStats
+
+COUNTERS = ("tweet_count", "like_given_count", "like_received_count")
+BATCH_SIZE = 1000
+
+
+def create_user_stats(sender, instance, created, raw, **kwargs):
+    """ユーザーのUserStatsの行を作る(Userのpost_saveシグナルのレシーバー)"""
+    if created and not raw:
+        UserStats.objects.bulk_create([UserStats(user_id=instance.pk)], ignore_conflicts=True)
+
+
+def add_counts(changes):
+    """{user_id: {カウンタ名: 増減}}をUserStatsに加える(カウンタがずれていても負の値にはしない)
+
+    BATCH_SIZE人ずつ、増減の値ごとのCASE式で1回のUPDATEにする。行がないユーザーは増やす分だけの行を作る。
+    """
+    changes = {
+        user_id: {field: deltas.get(field, 0) for field in COUNTERS}
+        for user_id, deltas in changes.items()
+        if any(deltas.values())
+    }
+    user_ids = list(changes)
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[start : start + BATCH_SIZE]
+        values = {}
+        for field in COUNTERS:
+            users_by_delta = defaultdict(list)
+            for user_id in batch:
+                if changes[user_id][field]:
+                    users_by_delta[changes[user_id][field]].append(user_id)
+            if users_by_delta:
+                delta = Case(*[When(pk__in=pks, then=Value(d)) for d, pks in users_by_delta.items()], default=Value(0))
+                values[field] = Greatest(F(field) + delta, Value(0), output_field=IntegerField())
+        if UserStats.objects.filter(pk__in=batch).update(**values) < len(batch):
+            existing = set(UserStats.objects.filter(pk__in=batch).values_list("pk", flat=True))
+            UserStats.objects.bulk_create(
+                [
+                    UserStats(user_id=pk, **{field: max(delta, 0) for field, delta in changes[pk].items()})
+                    for pk in batch
+                    if pk not in existing
+                ],
+                ignore_conflicts=True,
+            )
+
+
+def like_changes(likes):
+    """[(いいねしたユーザーのid, 投稿者のid, いいね数の増減), ...]をadd_countsに渡す形にする"""
+    changes = defaultdict(lambda: defaultdict(int))
+    for user_id, author_id, delta in likes:
+        changes[user_id]["like_given_count"] += delta
+        changes[author_id]["like_received_count"] += delta
+    return changes
+
+
+def record_likes(likes):
+    """いいね・いいね取り消しを、いいねしたユーザーと投稿者のいいね数に反映する(likes.pyから呼ぶ)"""
+    add_counts(like_changes(likes))
+
+
+def record_tweet(tweet):
+    """作成したツイートを投稿者のツイート数と最後にツイートした日時に反映する"""
+    updated = UserStats.objects.filter(pk=tweet.user_id).update(
+        tweet_count=F("tweet_count") + 1, last_tweet_at=tweet.created_at
+    )
+    if not updated:
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=tweet.user_id, tweet_count=1, last_tweet_at=tweet.created_at)], ignore_conflicts=True
+        )
+
+
+def record_tweet_deletion(tweet):
+    """削除するツイートを、投稿者とそのツイートにいいねしたユーザーのカウンタに反映し、いいねしたユーザーのidを返す
+    (削除する前に呼ぶ)
+
+    いいねはツイートと一緒に削除されるので、いいねした数・いいねされた数も減らす。
+    """
+    liker_ids = list(Like.objects.filter(tweet=tweet).values_list("user_id", flat=True))
+    changes = like_changes((user_id, tweet.user_id, -1) for user_id in liker_ids)
+    changes[tweet.user_id]["tweet_count"] -= 1
+    add_counts(changes)
+    latest = Tweet.objects.filter(user_id=tweet.user_id).exclude(pk=tweet.pk).order_by("-created_at")
+    UserStats.objects.filter(pk=tweet.user_id).update(last_tweet_at=Subquery(latest.values("created_at")[:1]))
+    return liker_ids
+
+
+def actual_values():
+    """UserStatsのカラムごとに、TweetとLikeから実際の値を求めるサブクエリ(reconcile_user_statsで使う)"""
+
+    def count(queryset, field):
+        rows = queryset.filter(**{field: OuterRef("pk")}).values(field).annotate(n=Count("pk"))
+        return Coalesce(Subquery(rows.values("n")), 0)
+
+    latest = Tweet.objects.filter(user=OuterRef("pk")).order_by("-created_at")
+    return {
+        "tweet_count": count(Tweet.objects.all(), "user"),
+        "like_given_count": count(Like.objects.all(), "user"),
+        "like_received_count": count(Like.objects.all(), "tweet__user"),
+        "last_tweet_at": Subquery(latest.values("created_at")[:1]),
+    }
+
+
+def get_stats(user):
+    """userのUserStats。行がなければ保存していない0のUserStatsを返す
+
+    UserProfileViewのようにselect_related("stats")で取得したuserなら、クエリは実行しない。
+    """
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return UserStats(user=user)
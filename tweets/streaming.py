@@ -0,0 +1,65 @@
+"""ツイートの一覧ページのストリーミング描画
+
+通常のTemplateResponseはページ全体を文字列にしてから送るため、ツイートの多いプロフィールでは
+最初の1バイトを送るまでに全件の取得と描画が終わっている必要があり、その間メモリも全件分使う。
+ストリーミングでは一覧の部分を空けたままページを描画して先頭を送り、ツイートをiterator()で
+少しずつ取得・描画して送ってから、残りを送る。
+
+Django 4.1のASGIハンドラーはストリーミングのレスポンスをイベントループの中で読むので、ツイートを取得する
+クエリがSynchronousOnlyOperationになる(非同期イテレーターに対応するのは4.2から)。ASGIでは常に通常の描画にする。
+"""
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+# 一覧を描画する位置の目印。ツイートの本文はエスケープされるので、本文中に現れることはない
+TWEET_SLOT = mark_safe("<!-- tweet_slot -->")
+
+
+class StreamingTweetListMixin:
+    """テンプレートのtweet_listの部分をストリーミングで描画する
+
+    テンプレートではtweet_slotがあればその位置に一覧を描画するので、ループの代わりに{{ tweet_slot }}を出力する。
+    ツイート1件はstream_item_template_nameのテンプレートで、tweetを渡して描画する。
+    settings.STREAM_TWEET_LISTSがTrueか、クエリ文字列に?stream=1がある場合にストリーミングにする(?stream=0で無効)。
+    ASGIで動かしている場合はストリーミングにしない。
+    """
+
+    stream_item_template_name = None
+    stream_chunk_size = 100  # iterator()で1回に取得する件数。この件数ごとにまとめて送る
+    stream_kwarg = "stream"
+
+    def is_streaming(self):
+        if isinstance(self.request, ASGIRequest):
+            return False
+        value = self.request.GET.get(self.stream_kwarg)
+        if value is None:
+            return settings.STREAM_TWEET_LISTS
+        return value not in ("", "0")
+
+    def render_to_response(self, context, **response_kwargs):
+        if not self.is_streaming():
+            return super().render_to_response(context, **response_kwargs)
+        # 一覧以外の部分はここで描画するので、CSRFトークンやメッセージはミドルウェアの処理前に確定する
+        page = render_to_string(self.get_template_names(), {**context, "tweet_slot": TWEET_SLOT}, self.request)
+        head, tail = page.split(TWEET_SLOT, 1)
+        return StreamingHttpResponse(self.stream(head, context["tweet_list"], tail), **response_kwargs)
+
+    def stream(self, head, tweets, tail):
+        yield head
+        template = get_template(self.stream_item_template_name)
+        if isinstance(tweets, QuerySet):
+            tweets = tweets.iterator(chunk_size=self.stream_chunk_size)
+        chunk = []
+        for tweet in tweets:
+            chunk.append(template.render({"tweet": tweet}, self.request))
+            if len(chunk) >= self.stream_chunk_size:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+        yield tail
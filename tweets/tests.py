@@ -1,12 +1,39 @@
+import json
+import math
+import re
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from accounts import recommendations
+from accounts.models import Friendship
 
-from .models import Like, Tweet
+from . import like_buffer, trending
+from .likes import add_like, apply_likes, remove_like
+from .models import Like, TimelineEntry, TrendingTweet, Tweet, UserStats
+from .pagination import CursorPaginator, InvalidCursor
 
 User = get_user_model()
 
 
+def page_words(html):
+    """空白とCSRFトークン(描画のたびに変わる)を除いたページの内容"""
+    return re.sub(r'name="csrfmiddlewaretoken" value="[^"]*"', "", html).split()
+
+
 class TestHomeView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="testuser", password="testpassword")
@@ -16,8 +43,184 @@ class TestHomeView(TestCase):
     def test_success_get(self):
         response = self.client.get(reverse("tweets:home"))
         tweets = response.context["tweet_list"]
-        self.assertEqual(tweets.count(), Tweet.objects.all().count())  # レコード数が一致するかどうか
-        self.assertEqual(tweets.first().created_at, Tweet.objects.first().created_at)
+        self.assertEqual(len(tweets), Tweet.objects.all().count())  # レコード数が一致するかどうか
+        self.assertEqual(tweets[0].created_at, Tweet.objects.first().created_at)
+
+    def test_success_get_with_cursor(self):
+        for i in range(24):
+            Tweet.objects.create(user=self.user, content="tweet{}".format(i))
+        newest_first = list(Tweet.objects.order_by("-created_at", "-id"))
+
+        response = self.client.get(reverse("tweets:home"))
+        page = response.context["page_obj"]
+        self.assertEqual(response.context["tweet_list"], newest_first[:20])
+        self.assertFalse(page.has_previous())
+
+        response = self.client.get(reverse("tweets:home"), {"cursor": page.next_cursor})
+        page = response.context["page_obj"]
+        self.assertEqual(response.context["tweet_list"], newest_first[20:])
+        self.assertFalse(page.has_next())
+
+        response = self.client.get(reverse("tweets:home"), {"cursor": page.previous_cursor})
+        self.assertEqual(response.context["tweet_list"], newest_first[:20])
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:home"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_hydrate(self):
+        first, second = Tweet.objects.bulk_create(Tweet(user=self.user, content=c) for c in ("first", "second"))
+        paginator = CursorPaginator(Tweet.objects.all())
+        # idsの順に並べ、存在しないidは除く
+        self.assertEqual(paginator.hydrate(Tweet.objects.all(), [second.pk, 500, first.pk]), [second, first])
+        rows = paginator.hydrate(Tweet.objects.values("id", "content"), [first.pk, second.pk])
+        self.assertEqual([row["content"] for row in rows], ["first", "second"])
+
+    def test_failure_get_with_unusable_cursor_values(self):
+        paginator = CursorPaginator(Tweet.objects.all())
+        now = timezone.now()
+        for position in ([None, 1], [now, None], [now, 2**63], [now, -(2**63) - 1]):
+            cursor = paginator.encode_cursor(position)
+            with self.assertRaises(InvalidCursor):
+                paginator.decode_cursor(cursor)
+            response = self.client.get(reverse("tweets:home"), {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_is_liked(self):
+        liked_tweet = Tweet.objects.create(user=self.user, content="liked")
+        Like.objects.create(tweet=liked_tweet, user=self.user)
+        response = self.client.get(reverse("tweets:home"))
+        is_liked = {tweet.content: tweet.is_liked for tweet in response.context["tweet_list"]}
+        self.assertEqual(is_liked, {"test_tweet": False, "liked": True})
+
+    def test_streaming(self):
+        Like.objects.create(tweet=self.tweet, user=self.user)
+        response = self.client.get(reverse("tweets:home"), {"stream": "1"})
+        self.assertTrue(response.streaming)
+        streamed = b"".join(response.streaming_content).decode()
+        rendered = self.client.get(reverse("tweets:home")).content.decode()
+        self.assertEqual(page_words(streamed), page_words(rendered))  # 空白以外は通常の描画と同じ
+
+
+class TestHomeTimeline(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.user3 = User.objects.create_user(username="testuser3", password="testpassword")
+        self.client.login(username="testuser1", password="testpassword")
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+
+    def tweet_as(self, user, content):
+        self.client.login(username=user.username, password="testpassword")
+        self.client.post(reverse("tweets:create"), {"content": content})
+        self.client.login(username="testuser1", password="testpassword")
+        return Tweet.objects.get(content=content)
+
+    def test_fan_out_on_create(self):
+        tweet = self.tweet_as(self.user2, "followed")
+        self.tweet_as(self.user3, "not_followed")
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user1, tweet=tweet).exists())
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual([t.content for t in response.context["tweet_list"]], ["followed"])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=0)
+    def test_popular_user_is_read_on_home(self):
+        self.tweet_as(self.user2, "popular")
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual([t.content for t in response.context["tweet_list"]], ["popular"])
+
+    def test_follow_and_unfollow_update_timeline(self):
+        tweet = Tweet.objects.create(user=self.user3, content="before_follow")
+        self.client.post(reverse("accounts:follow", kwargs={"username": self.user3.username}))
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user1, tweet=tweet).exists())
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user3.username}))
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user1, tweet=tweet).exists())
+
+
+class TestEngagementQueries(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="otheruser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def count_queries(self, url, tweets):
+        for i in range(tweets - Tweet.objects.count()):
+            tweet = Tweet.objects.create(user=self.user, content="tweet{}".format(i), like_count=1)
+            Like.objects.create(tweet=tweet, user=self.other if i % 2 else self.user)
+        recommendations.invalidate(self.user.pk)  # 自分のプロフィールのおすすめユーザーは毎回集計させる
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_home_query_count_does_not_grow(self):
+        url = reverse("tweets:home")
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 12))
+
+    def test_profile_query_count_does_not_grow(self):
+        url = reverse("accounts:profile", kwargs={"username": self.user.username})
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 12))
+
+
+class TestTweetApi(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.client.login(username="testuser1", password="testpassword")
+        self.tweets = [Tweet.objects.create(user=self.user1, content="tweet{}".format(i)) for i in range(25)]
+        self.other_tweet = Tweet.objects.create(user=self.user2, content="other")
+        Like.objects.create(tweet=self.tweets[-1], user=self.user1)
+
+    def test_home(self):
+        response = self.client.get(reverse("tweets:api_home"))
+        self.assertEqual(response["Content-Type"], "application/json")
+        data = response.json()
+        self.assertEqual(
+            [tweet["content"] for tweet in data["tweets"]], ["tweet{}".format(i) for i in range(24, 4, -1)]
+        )
+        self.assertEqual(set(data["tweets"][0]), {"id", "content", "created_at", "like_count", "is_liked", "username"})
+        self.assertTrue(data["tweets"][0]["is_liked"])
+        self.assertEqual(data["tweets"][0]["username"], "testuser1")
+        self.assertIsNone(data["previous_cursor"])
+
+        response = self.client.get(reverse("tweets:api_home"), {"cursor": data["next_cursor"]})
+        data = response.json()
+        self.assertEqual(
+            [tweet["content"] for tweet in data["tweets"]], ["tweet{}".format(i) for i in range(4, -1, -1)]
+        )
+        self.assertIsNone(data["next_cursor"])
+
+    def test_user_tweets(self):
+        response = self.client.get(reverse("tweets:api_user_tweets", kwargs={"username": "testuser2"}))
+        self.assertEqual([tweet["content"] for tweet in response.json()["tweets"]], ["other"])
+        response = self.client.get(reverse("tweets:api_user_tweets", kwargs={"username": "nobody"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail(self):
+        response = self.client.get(reverse("tweets:api_detail", kwargs={"pk": self.other_tweet.pk}))
+        self.assertEqual(response.json()["tweet"]["content"], "other")
+        self.assertFalse(response.json()["tweet"]["is_liked"])
+        response = self.client.get(reverse("tweets:api_detail", kwargs={"pk": 500}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_etag(self):
+        url = reverse("tweets:api_detail", kwargs={"pk": self.other_tweet.pk})
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.other_tweet.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:api_home"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 400)
+        cursor = CursorPaginator(Tweet.objects.all()).encode_cursor([timezone.now(), 2**64])
+        response = self.client.get(reverse("tweets:api_home"), {"cursor": cursor})
+        self.assertEqual(response.status_code, 400)
 
 
 class TestTweetCreateView(TestCase):
@@ -69,6 +272,38 @@ class TestTweetDetailView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context["tweet"], self.tweet)
 
+    def test_is_liked(self):
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertFalse(response.context["tweet"].is_liked)
+        Like.objects.create(tweet=self.tweet, user=self.user)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertTrue(response.context["tweet"].is_liked)
+
+    def test_not_modified(self):
+        cache.clear()
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        etag = self.client.get(url)["ETag"]
+        # ツイートのクエリもテンプレートの描画もせずに304を返す
+        with self.assertTemplateNotUsed("tweets/detail.html"), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any("tweets_like" in query["sql"] for query in queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["tweet"].is_liked)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_not_modified_per_viewer(self):
+        cache.clear()
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        etag = self.client.get(url)["ETag"]
+        User.objects.create_user(username="testuser2", password="testpassword")
+        self.client.login(username="testuser2", password="testpassword")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
 
 class TestTweetDeleteView(TestCase):
     def setUp(self):
@@ -99,6 +334,38 @@ class TestTweetDeleteView(TestCase):
         self.assertEqual(Tweet.objects.count(), 2)
 
 
+class TestTweetCards(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user1, content="tweet1")
+        self.profile_url = reverse("accounts:profile", kwargs={"username": "testuser1"})
+        version = [self.tweet.pk, self.tweet.created_at.timestamp()]
+        self.fragment_key = make_template_fragment_key("home_tweet", version)
+
+    def test_like_state_per_viewer(self):
+        self.client.login(username="testuser1", password="testpassword")
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        liked_button = 'data-tweet-id="{}" data-liked="true"'.format(self.tweet.pk)
+        response = self.client.get(self.profile_url)
+        self.assertContains(response, liked_button)
+        self.assertContains(response, '<span class="count_{}">1</span>'.format(self.tweet.pk), html=True)
+
+        # ツイートの断片はキャッシュを共有するが、いいねボタンは閲覧者ごとに変わる
+        self.client.login(username="testuser2", password="testpassword")
+        response = self.client.get(self.profile_url)
+        self.assertNotContains(response, liked_button)
+        self.assertContains(response, '<span class="count_{}">1</span>'.format(self.tweet.pk), html=True)
+
+    def test_invalidate_on_delete(self):
+        self.client.login(username="testuser1", password="testpassword")
+        self.client.get(reverse("tweets:home"))
+        self.assertIsNotNone(cache.get(self.fragment_key))
+        self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet.pk}))
+        self.assertIsNone(cache.get(self.fragment_key))
+
+
 class TestFavoriteView(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
@@ -121,6 +388,22 @@ class TestFavoriteView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.filter(tweet=self.tweet, user=self.user1).count(), 1)
 
+    def test_like_count_is_not_incremented_twice(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    def test_write_queries(self):
+        # INSERT、UPDATE、SELECTの3つとユーザーごとのいいね数のUPDATE、トレンドのスコアのSELECT、INSERT
+        # (とテスト中のトランザクションのSAVEPOINT、RELEASE)
+        with self.assertNumQueries(8):
+            self.assertEqual(add_like(self.tweet.pk, self.user1), 1)
+        # すでにいいねしていればUPDATEしない
+        with self.assertNumQueries(4):
+            self.assertEqual(add_like(self.tweet.pk, self.user1), 1)
+
 
 class TestUnfavoriteView(TestCase):
     def setUp(self):
@@ -144,3 +427,495 @@ class TestUnfavoriteView(TestCase):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
         Like.objects.filter(tweet=self.tweet, user=self.user1).delete()
         self.assertEqual(response.status_code, 200)
+
+    def test_like_count_is_decremented(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 0)
+        response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 0)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+    def test_write_queries(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        # いいねした時刻のSELECT、DELETE、UPDATE、SELECTの4つとユーザーごとのいいね数のUPDATE、トレンドのスコアのSELECT
+        # (とテスト中のトランザクションのSAVEPOINT、RELEASE)
+        # setUpのいいねはスコアに反映していないので、スコアの削除はない
+        with self.assertNumQueries(8):
+            self.assertEqual(remove_like(self.tweet.pk, self.user1), 0)
+
+
+class TestLikeBatchView(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.tweets = [Tweet.objects.create(user=self.user2, content="tweet{}".format(i)) for i in range(3)]
+        self.client.login(username="testuser1", password="testpassword")
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweets[2].pk}))
+
+    def post(self, operations):
+        return self.client.post(
+            reverse("tweets:like_batch"), json.dumps({"operations": operations}), content_type="application/json"
+        )
+
+    def test_success_post(self):
+        response = self.post(
+            [
+                {"tweet_id": self.tweets[0].pk, "liked": True},
+                {"tweet_id": self.tweets[1].pk, "liked": True},
+                {"tweet_id": self.tweets[1].pk, "liked": False},  # 同じツイートは最後の操作だけを反映する
+                {"tweet_id": self.tweets[2].pk, "liked": False},
+                {"tweet_id": 500, "liked": True},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        tweets = {tweet["tweet_id"]: tweet for tweet in response.json()["tweets"]}
+        self.assertEqual(
+            tweets,
+            {
+                self.tweets[0].pk: {"tweet_id": self.tweets[0].pk, "like_count": 1, "is_liked": True},
+                self.tweets[1].pk: {"tweet_id": self.tweets[1].pk, "like_count": 0, "is_liked": False},
+                self.tweets[2].pk: {"tweet_id": self.tweets[2].pk, "like_count": 0, "is_liked": False},
+            },
+        )
+        self.assertEqual(list(Like.objects.values_list("tweet_id", flat=True)), [self.tweets[0].pk])
+
+    def test_liked_twice(self):
+        self.post([{"tweet_id": self.tweets[2].pk, "liked": True}])
+        self.assertEqual(Tweet.objects.get(pk=self.tweets[2].pk).like_count, 1)
+
+    def test_queries_do_not_grow_with_operations(self):
+        tweets = [Tweet(user=self.user2, content="tweet") for _ in range(20)]
+        operations = [{"tweet_id": tweet.pk, "liked": True} for tweet in Tweet.objects.bulk_create(tweets)]
+        with CaptureQueriesContext(connection) as few:
+            self.post(operations[:2])
+        with CaptureQueriesContext(connection) as many:
+            self.post(operations[2:])
+        self.assertEqual(len(few), len(many))
+
+    def test_failure_post_with_invalid_body(self):
+        response = self.client.post(reverse("tweets:like_batch"), "invalid", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.post([{"tweet_id": self.tweets[0].pk}])
+        self.assertEqual(response.status_code, 400)
+        response = self.post([{"tweet_id": i, "liked": True} for i in range(101)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_failure_post_with_non_bool_liked(self):
+        # "false"や0をいいねの有無として扱わない
+        for liked in ("false", "true", 0, 1, None):
+            response = self.post([{"tweet_id": self.tweets[1].pk, "liked": liked}])
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_failure_post_with_non_int_tweet_id(self):
+        # trueや1.7をツイートのid 1として扱わず、範囲外の整数も500にしない
+        for tweet_id in (True, self.tweets[1].pk + 0.7, str(self.tweets[1].pk), None, 0, 2**63, -1):
+            response = self.post([{"tweet_id": tweet_id, "liked": True}])
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.count(), 1)
+
+
+class TestLikeWriteBehind(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_path = Path(directory.name) / "like_buffer.log"
+        settings = override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_PATH=self.log_path, LIKE_FLUSH_INTERVAL=None)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user2, content="tweet")
+        self.client.login(username="testuser1", password="testpassword")
+
+    def test_like_is_written_on_flush(self):
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 1)  # まだ反映していないが、反映後のいいね数を返す
+        self.assertFalse(Like.objects.exists())
+
+        out = StringIO()
+        call_command("flush_likes", stdout=out)
+        self.assertIn("1件", out.getvalue())
+        self.assertTrue(Like.objects.filter(tweet=self.tweet, user=self.user1).exists())
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, 1)
+
+    def test_coalesce(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
+        like_buffer.record(self.user2, {self.tweet.pk: True})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(like_buffer.flush(), 2)
+        updates = [query for query in queries if query["sql"].startswith('UPDATE "tweets_tweet"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(list(Like.objects.values_list("user", flat=True)), [self.user2.pk])
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, 1)
+
+    def test_replay_after_crash(self):
+        like_buffer.record(self.user1, {self.tweet.pk: True})
+        # ログの名前を変えた後、反映する前に落ちた状態を作る
+        self.log_path.rename(self.log_path.with_name(self.log_path.name + ".1.flushing"))
+        like_buffer.record(self.user1, {self.tweet.pk: False})
+        like_buffer.record(self.user2, {self.tweet.pk: True})
+        with open(self.log_path, "a") as log:
+            log.write('{"tweet_id": ')  # 書き込み途中で落ちた行
+
+        with self.assertLogs("tweets.like_buffer", "WARNING"):
+            self.assertEqual(like_buffer.flush(), 2)
+        self.assertEqual(list(Like.objects.values_list("user", flat=True)), [self.user2.pk])
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, 1)
+        self.assertEqual(list(self.log_path.parent.glob("*.flushing")), [])
+        self.assertEqual(like_buffer.flush(), 0)
+
+    def test_append_after_torn_line(self):
+        with open(self.log_path, "w") as log:
+            log.write('{"tweet_id": ')  # 書き込み途中で落ちた行
+        like_buffer.record(self.user1, {self.tweet.pk: True})
+        with self.assertLogs("tweets.like_buffer", "WARNING"):
+            self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(list(Like.objects.values_list("user", flat=True)), [self.user1.pk])
+
+    def test_flush_after_user_deleted(self):
+        user3 = User.objects.create_user(username="testuser3", password="testpassword")
+        like_buffer.record(self.user1, {self.tweet.pk: True})
+        like_buffer.record(user3, {self.tweet.pk: True})
+        user3.delete()
+        # 削除されたユーザーの操作だけを無視し、他の操作は反映してログを消す
+        self.assertEqual(like_buffer.flush(), 2)
+        self.assertEqual(list(Like.objects.values_list("user", flat=True)), [self.user1.pk])
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, 1)
+        self.assertEqual(list(self.log_path.parent.glob("*.flushing")), [])
+
+    def test_failure_post_with_not_exist_tweet(self):
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": 500}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(self.log_path.exists())
+
+
+class TestAsyncLikeView(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user2, content="tweet")
+        self.async_client.force_login(self.user1)
+
+    async def test_like_and_unlike(self):
+        response = await self.async_client.post(reverse("tweets:like_async", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["like_count"], 1)
+        self.assertEqual(response.json()["unlike_url"], reverse("tweets:unlike_async", kwargs={"pk": self.tweet.pk}))
+        self.assertTrue(await Like.objects.filter(tweet=self.tweet, user=self.user1).aexists())
+
+        response = await self.async_client.post(reverse("tweets:unlike_async", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.json()["like_count"], 0)
+        self.assertFalse(await Like.objects.filter(tweet=self.tweet, user=self.user1).aexists())
+
+    async def test_unchanged_like_is_read_only(self):
+        await self.async_client.post(reverse("tweets:like_async", kwargs={"pk": self.tweet.pk}))
+        # すでにいいねしていれば、スレッドで書き込まずに非同期のORMで読んだいいね数を返す
+        with patch("tweets.views.set_like", side_effect=AssertionError("書き込まない")):
+            response = await self.async_client.post(reverse("tweets:like_async", kwargs={"pk": self.tweet.pk}))
+            self.assertEqual(response.json()["like_count"], 1)
+            response = await self.async_client.post(reverse("tweets:unlike_async", kwargs={"pk": 500}))
+            self.assertEqual(response.status_code, 404)
+
+    async def test_failure_post_with_not_exist_tweet(self):
+        response = await self.async_client.post(reverse("tweets:like_async", kwargs={"pk": 500}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_failure_post_without_login(self):
+        response = await AsyncClient().post(reverse("tweets:like_async", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await Like.objects.acount(), 0)
+
+
+class TestTrending(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username="testuser{}".format(i), password="testpassword") for i in range(3)
+        ]
+        self.tweets = [Tweet.objects.create(user=self.users[0], content="tweet{}".format(i)) for i in range(3)]
+        self.client.login(username="testuser0", password="testpassword")
+
+    def test_rank_by_likes(self):
+        for user in self.users:
+            add_like(self.tweets[1].pk, user)
+        add_like(self.tweets[2].pk, self.users[0])
+        response = self.client.get(reverse("tweets:trending"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet_list"], [self.tweets[1], self.tweets[2]])
+
+    def test_follow_buttons(self):
+        tweet = Tweet.objects.create(user=self.users[1], content="other")
+        add_like(tweet.pk, self.users[1])
+        add_like(self.tweets[0].pk, self.users[1])
+        response = self.client.get(reverse("tweets:trending"))
+        self.assertEqual([tweet.relationship.following for tweet in response.context["tweet_list"]], [False, False])
+        # 自分のツイートにはフォローボタンを出さない
+        self.assertContains(response, "フォローする</button>", count=1)
+
+    def test_decay(self):
+        now = timezone.now()
+        # 2半減期前のいいね3件(3/4件分)より、今のいいね1件の方が上になる
+        trending.record_likes({self.tweets[0].pk: [now - timedelta(seconds=2 * settings.TRENDING_HALF_LIFE)] * 3})
+        trending.record_likes({self.tweets[1].pk: [now]})
+        ranked = list(TrendingTweet.objects.order_by("-score").values_list("tweet_id", flat=True))
+        self.assertEqual(ranked, [self.tweets[1].pk, self.tweets[0].pk])
+
+    def test_unlike(self):
+        add_like(self.tweets[0].pk, self.users[1])
+        add_like(self.tweets[0].pk, self.users[2])
+        remove_like(self.tweets[0].pk, self.users[1])
+        self.assertTrue(TrendingTweet.objects.filter(pk=self.tweets[0].pk).exists())
+        remove_like(self.tweets[0].pk, self.users[2])
+        self.assertFalse(TrendingTweet.objects.filter(pk=self.tweets[0].pk).exists())
+
+    def test_unlike_old_likes(self):
+        # 1日前のいいね10件のうち1件を取り消しても、引くのはそのいいねの時刻の重みなので9件分が残る
+        users = User.objects.bulk_create([User(username="liker{}".format(i)) for i in range(10)])
+        liked_at = timezone.now() - timedelta(days=1)
+        for user in users:
+            add_like(self.tweets[0].pk, user)
+        Like.objects.filter(tweet=self.tweets[0]).update(created_at=liked_at)
+        trending.rebuild()
+        remove_like(self.tweets[0].pk, users[0])
+        expected = trending.weight_exponent(liked_at) + math.log2(9)
+        self.assertAlmostEqual(TrendingTweet.objects.get(pk=self.tweets[0].pk).score, expected)
+        apply_likes(users[1], {self.tweets[0].pk: False})
+        expected = trending.weight_exponent(liked_at) + math.log2(8)
+        self.assertAlmostEqual(TrendingTweet.objects.get(pk=self.tweets[0].pk).score, expected)
+
+    def test_batch(self):
+        self.client.post(
+            reverse("tweets:like_batch"),
+            json.dumps({"operations": [{"tweet_id": tweet.pk, "liked": True} for tweet in self.tweets[:2]]}),
+            content_type="application/json",
+        )
+        self.assertEqual(TrendingTweet.objects.count(), 2)
+
+    @override_settings(TRENDING_MAX_ENTRIES=1)
+    def test_compact(self):
+        now = timezone.now()
+        expired = now - timedelta(seconds=(settings.TRENDING_EXPIRE_HALF_LIVES + 1) * settings.TRENDING_HALF_LIFE)
+        trending.record_likes({self.tweets[0].pk: [expired]})
+        trending.record_likes({self.tweets[1].pk: [now, now], self.tweets[2].pk: [now]})
+        out = StringIO()
+        call_command("compact_trending", stdout=out)
+        self.assertIn("2件", out.getvalue())
+        self.assertEqual(list(TrendingTweet.objects.values_list("tweet_id", flat=True)), [self.tweets[1].pk])
+
+    def test_rebuild(self):
+        add_like(self.tweets[0].pk, self.users[1])
+        add_like(self.tweets[1].pk, self.users[1])
+        add_like(self.tweets[1].pk, self.users[2])
+        scores = dict(TrendingTweet.objects.values_list("tweet_id", "score"))
+        Like.objects.bulk_create([Like(tweet=self.tweets[2], user=self.users[1])])
+        call_command("compact_trending", "--rebuild", stdout=StringIO())
+        rebuilt = dict(TrendingTweet.objects.values_list("tweet_id", "score"))
+        self.assertEqual(set(rebuilt), {tweet.pk for tweet in self.tweets})
+        for pk, score in scores.items():
+            self.assertAlmostEqual(rebuilt[pk], score, places=3)
+
+
+class TestReconcileLikeCountsCommand(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.tweet1 = Tweet.objects.create(user=self.user, content="tweet1")
+        self.tweet2 = Tweet.objects.create(user=self.user, content="tweet2", like_count=5)
+        Like.objects.create(tweet=self.tweet1, user=self.user)
+
+    def test_fix_drifted_counts(self):
+        out = StringIO()
+        call_command("reconcile_like_counts", stdout=out)
+        self.assertIn("2件", out.getvalue())
+        self.assertEqual(Tweet.objects.get(pk=self.tweet1.pk).like_count, 1)
+        self.assertEqual(Tweet.objects.get(pk=self.tweet2.pk).like_count, 0)
+
+    def test_dry_run(self):
+        call_command("reconcile_like_counts", "--dry-run", stdout=StringIO())
+        self.assertEqual(Tweet.objects.get(pk=self.tweet2.pk).like_count, 5)
+
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.create_user(username="testuser2", password="testpassword")
+        self.client.login(username="testuser1", password="testpassword")
+
+    def get_stats(self, user):
+        row = UserStats.objects.get(pk=user.pk)
+        return row.tweet_count, row.like_given_count, row.like_received_count
+
+    def test_created_with_user(self):
+        self.assertEqual(self.get_stats(self.user1), (0, 0, 0))
+        self.assertIsNone(UserStats.objects.get(pk=self.user1.pk).last_tweet_at)
+
+    def test_tweet_and_like(self):
+        self.client.post(reverse("tweets:create"), {"content": "first"})
+        self.client.post(reverse("tweets:create"), {"content": "second"})
+        tweet = Tweet.objects.latest("created_at")
+        self.assertEqual(UserStats.objects.get(pk=self.user1.pk).last_tweet_at, tweet.created_at)
+
+        self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk}))
+        add_like(tweet.pk, self.user2)
+        self.assertEqual(self.get_stats(self.user1), (2, 1, 2))
+        self.assertEqual(self.get_stats(self.user2), (0, 1, 0))
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": tweet.pk}))
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": tweet.pk}))  # いいねしていなければ変わらない
+        self.assertEqual(self.get_stats(self.user1), (2, 0, 1))
+
+    def test_apply_likes(self):
+        tweets = [Tweet.objects.create(user=self.user2, content="tweet{}".format(i)) for i in range(3)]
+        add_like(tweets[0].pk, self.user1)
+        apply_likes(self.user1, {tweets[0].pk: False, tweets[1].pk: True, tweets[2].pk: True})
+        self.assertEqual(self.get_stats(self.user1)[1:], (2, 0))
+        self.assertEqual(self.get_stats(self.user2)[1:], (0, 2))
+
+    def test_delete_tweet(self):
+        first = Tweet.objects.create(user=self.user1, content="first")
+        second = Tweet.objects.create(user=self.user1, content="second")
+        UserStats.objects.filter(pk=self.user1.pk).update(tweet_count=2, last_tweet_at=second.created_at)
+        add_like(second.pk, self.user1)
+        add_like(second.pk, self.user2)
+        self.client.post(reverse("tweets:delete", kwargs={"pk": second.pk}))
+        # ツイートと一緒に削除されたいいねの分も減らし、最後にツイートした日時は残ったツイートにする
+        self.assertEqual(self.get_stats(self.user1), (1, 0, 0))
+        self.assertEqual(self.get_stats(self.user2), (0, 0, 0))
+        self.assertEqual(UserStats.objects.get(pk=self.user1.pk).last_tweet_at, first.created_at)
+
+    def test_delete_tweet_modifies_liker_profile(self):
+        tweet = Tweet.objects.create(user=self.user1, content="tweet")
+        add_like(tweet.pk, self.user2)
+        url = reverse("accounts:profile", kwargs={"username": self.user2.username})
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        # いいねした数が減るので、いいねしたユーザーのプロフィールも304にしない
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["stats"].like_given_count, 0)
+
+    def test_missing_row(self):
+        # bulk_createで作ったユーザーにはシグナルが送られないので行がない
+        user = User.objects.bulk_create([User(username="bulkuser")])[0]
+        tweet = Tweet.objects.create(user=self.user2, content="tweet")
+        add_like(tweet.pk, user)
+        self.assertEqual(self.get_stats(user), (0, 1, 0))
+        self.assertEqual(self.get_stats(self.user2), (0, 0, 1))
+
+    def test_never_negative(self):
+        tweet = Tweet.objects.create(user=self.user2, content="tweet")
+        Like.objects.create(tweet=tweet, user=self.user1)
+        remove_like(tweet.pk, self.user1)
+        self.assertEqual(self.get_stats(self.user1), (0, 0, 0))
+        self.assertEqual(self.get_stats(self.user2), (0, 0, 0))
+
+    def test_profile_header(self):
+        Tweet.objects.create(user=self.user2, content="tweet")
+        call_command("reconcile_user_stats", stdout=StringIO())
+        url = reverse("accounts:profile", kwargs={"username": self.user2.username})
+        response = self.client.get(url)
+        self.assertEqual(response.context["stats"].tweet_count, 1)
+        self.assertContains(response, "ツイート数:1")
+        # ヘッダーの分のクエリはユーザーとUserStatsを結合した1回だけ
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        header_queries = [query["sql"] for query in queries if "tweets_userstats" in query["sql"]]
+        self.assertEqual(len(header_queries), 1)
+        self.assertIn('"accounts_user"."username" =', header_queries[0])
+
+    def test_profile_without_row(self):
+        UserStats.objects.filter(pk=self.user2.pk).delete()
+        response = self.client.get(reverse("accounts:profile", kwargs={"username": self.user2.username}))
+        self.assertContains(response, "ツイート数:0")
+
+
+class TestReconcileUserStatsCommand(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="testuser1", password="testpassword")
+        self.user2 = User.objects.bulk_create([User(username="testuser2")])[0]
+        self.tweet = Tweet.objects.create(user=self.user1, content="tweet")
+        Like.objects.create(tweet=self.tweet, user=self.user2)
+        UserStats.objects.filter(pk=self.user1.pk).update(like_given_count=3)
+
+    def test_fix_drifted_counts(self):
+        out = StringIO()
+        call_command("reconcile_user_stats", stdout=out)
+        self.assertIn("1人の行を作成し、2人", out.getvalue())
+        row = UserStats.objects.get(pk=self.user1.pk)
+        self.assertEqual((row.tweet_count, row.like_given_count, row.like_received_count), (1, 0, 1))
+        self.assertEqual(row.last_tweet_at, self.tweet.created_at)
+        row = UserStats.objects.get(pk=self.user2.pk)
+        self.assertEqual((row.tweet_count, row.like_given_count, row.like_received_count), (0, 1, 0))
+        # 修正した後はずれていない
+        out = StringIO()
+        call_command("reconcile_user_stats", "--dry-run", stdout=out)
+        self.assertIn("0人", out.getvalue())
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("reconcile_user_stats", "--dry-run", stdout=out)
+        self.assertIn("2人", out.getvalue())
+        self.assertFalse(UserStats.objects.filter(pk=self.user2.pk).exists())
+        self.assertEqual(UserStats.objects.get(pk=self.user1.pk).like_given_count, 3)
+
+
+class TestSeedSocialCommand(TestCase):
+    options = ["--users", "30", "--tweets", "90", "--likes", "120", "--follows", "4", "--batch-size", "10"]
+
+    def seed(self, *args):
+        call_command("seed_social", *self.options, *args, stdout=StringIO())
+
+    def snapshot(self):
+        return (
+            sorted(Friendship.objects.values_list("follower__username", "following__username")),
+            sorted(Tweet.objects.values_list("user__username", "content")),
+            sorted(Like.objects.values_list("user__username", "tweet__content")),
+        )
+
+    def test_generate(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Tweet.objects.count(), 90)
+        self.assertGreater(Like.objects.count(), 0)
+        self.assertTrue(User.objects.first().check_password("password"))
+        # 非正規化したカウンタも実際の件数と一致している
+        user = User.objects.order_by("-follower_count").first()
+        self.assertEqual(user.follower_count, Friendship.objects.filter(following=user).count())
+        tweet = Tweet.objects.order_by("-like_count").first()
+        self.assertEqual(tweet.like_count, Like.objects.filter(tweet=tweet).count())
+        stats = UserStats.objects.get(pk=tweet.user_id)
+        self.assertEqual(stats.tweet_count, Tweet.objects.filter(user=tweet.user).count())
+        self.assertTrue(TimelineEntry.objects.exists())
+
+    def test_deterministic(self):
+        self.seed()
+        first = self.snapshot()
+        User.objects.all().delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+        User.objects.all().delete()
+        self.seed("--seed", "1")
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_resume(self):
+        self.seed()
+        expected = self.snapshot()
+        # いいねの生成中に止まった状態から再開する(チャンク単位でコミットしているので、チャンクの境目で止まる)
+        Like.objects.filter(user__username__gte="seed00000010").delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), expected)
+        # ツイートの生成中に止まった状態から再開する
+        Like.objects.all().delete()
+        Tweet.objects.filter(user__username__gte="seed00000020").delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), expected)
+        # ユーザーの生成中に止まった状態から再開する
+        Friendship.objects.all().delete()
+        Tweet.objects.all().delete()
+        User.objects.filter(username__gte="seed00000025").delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), expected)
@@ -0,0 +1,75 @@
+"""フォローしているユーザーのツイートを並べるホームタイムライン
+
+ツイート作成時にフォロワー全員のTimelineEntryへ書き込んでおき(fan-out-on-write)、
+ホームの表示はTimelineEntryを(owner, created_at)のインデックスで読むだけにする。
+フォロワーがTIMELINE_FANOUT_THRESHOLDより多いユーザーは書き込みが重くなりすぎるため
+書き込まず、自分のツイートと一緒に表示時に取得する(fan-out-on-read)。
+"""
+
+from django.conf import settings
+
+from accounts.models import Friendship
+
+from .models import TimelineEntry, Tweet
+from .pagination import CursorPaginator
+
+BATCH_SIZE = 1000
+
+
+def is_fanout_author(user):
+    return user.follower_count <= settings.TIMELINE_FANOUT_THRESHOLD
+
+
+def fan_out(tweet):
+    """ツイートをフォロワーのタイムラインに書き込む"""
+    if not is_fanout_author(tweet.user):
+        return
+    follower_ids = Friendship.objects.filter(following_id=tweet.user_id).values_list("follower_id", flat=True)
+    entries = (TimelineEntry(owner_id=owner_id, tweet=tweet, created_at=tweet.created_at) for owner_id in follower_ids)
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def backfill(follower, following):
+    """フォローしたユーザーの最近のツイートをタイムラインに追加する"""
+    if not is_fanout_author(following):
+        return
+    tweets = Tweet.objects.filter(user=following).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    entries = [
+        TimelineEntry(owner=follower, tweet_id=pk, created_at=created_at)
+        for pk, created_at in tweets.values_list("pk", "created_at")
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def remove(follower, following):
+    """フォローを外したユーザーのツイートをタイムラインから取り除く"""
+    TimelineEntry.objects.filter(owner=follower, tweet__user=following).delete()
+
+
+def pull_author_ids(user):
+    """タイムラインに書き込まれないため、表示時に取得するユーザー(自分とフォロワーの多いユーザー)"""
+    threshold = settings.TIMELINE_FANOUT_THRESHOLD
+    popular = Friendship.objects.filter(follower=user, following__follower_count__gt=threshold).values_list(
+        "following_id", flat=True
+    )
+    return [user.pk, *popular]
+
+
+class HomeTimelinePaginator(CursorPaginator):
+    """TimelineEntryと表示時に取得するツイートをマージし、querysetでツイート本体を取得する
+
+    querysetはvalues()のクエリセットでもよい(その場合はidを含めること)。
+    """
+
+    def __init__(self, user, queryset, per_page=20):
+        entries = TimelineEntry.objects.filter(owner=user).only("created_at", "tweet_id")
+        super().__init__(entries, ("-created_at", "-tweet_id"), per_page)
+        pulled = Tweet.objects.filter(user_id__in=pull_author_ids(user)).only("created_at", "id")
+        self.add_source(pulled, ("-created_at", "-id"))
+        self.tweet_queryset = queryset
+
+    def page(self, cursor=None):
+        page = super().page(cursor)
+        tweet_ids = [row.tweet_id if isinstance(row, TimelineEntry) else row.pk for row in page.object_list]
+        page.object_list = self.hydrate(self.tweet_queryset, tweet_ids)
+        return page
@@ -0,0 +1,136 @@
+"""いいねの時間減衰スコアによるトレンド
+
+いいね1件の重みは、いいねした時刻tについて2^((t - EPOCH) / 半減期)とする。重みは時刻とともに増えるので、
+古いいいねの重みは相対的に半減期ごとに半分になる。ツイートのスコアは重みの合計のlog2で、
+TrendingTweetに保存してscoreのインデックスで並べる。表示のたびにLikeを集計しないので、1ページ分の読み込みで済む。
+
+スコアはいいね・いいね取り消しのたびにlikes.pyから更新する。取り消す時は、削除するLikeのcreated_atの重みを引き、
+0以下になったら削除する(取り消した時刻の重みを引くと、古いいいねの合計より大きくなってしまう)。
+古いツイートやスコアの低いツイートはcompact()で削除し、TRENDING_MAX_ENTRIES件以下に保つ。
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as django_timezone
+
+from .models import Like, TrendingTweet
+from .pagination import CursorPaginator
+
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+BATCH_SIZE = 1000
+
+
+def weight_exponent(when):
+    """いいねした時刻の重みのlog2"""
+    return (when - EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+
+
+def add_log2(score, delta, exponent):
+    """2^score + delta * 2^exponentのlog2を返す。0以下になればNoneを返す"""
+    if score is None:
+        return exponent + math.log2(delta) if delta > 0 else None
+    top = max(score, exponent)
+    total = 2 ** (score - top) + delta * 2 ** (exponent - top)
+    if total <= 1e-9:  # 浮動小数点の誤差で残った分は0とみなす
+        return None
+    return top + math.log2(total)
+
+
+def record_likes(added=None, removed=None):
+    """追加したいいねと取り消したいいねを、それぞれ{tweet_id: [いいねのcreated_at, ...]}で受け取りスコアに反映する
+
+    いいねと同じトランザクションで、存在するツイートについてだけ呼び出す。
+    追加と取り消しで同じいいねには同じ重みを使うので、Likeに保存したcreated_atを渡す。
+    """
+    added = {pk: times for pk, times in (added or {}).items() if times}
+    removed = {pk: times for pk, times in (removed or {}).items() if times}
+    if not added and not removed:
+        return
+    with transaction.atomic(savepoint=False):
+        rows = {
+            row.pk: row for row in TrendingTweet.objects.select_for_update().filter(tweet_id__in={*added, *removed})
+        }
+        created, updated, deleted = [], [], []
+        for tweet_id in {*added, *removed}:
+            row = rows.get(tweet_id)
+            score = row.score if row else None
+            for created_at in added.get(tweet_id, ()):
+                score = add_log2(score, 1, weight_exponent(created_at))
+            for created_at in removed.get(tweet_id, ()):
+                if score is None:
+                    break
+                score = add_log2(score, -1, weight_exponent(created_at))
+            if row is None:
+                if score is not None:
+                    created.append(TrendingTweet(tweet_id=tweet_id, score=score))
+            elif score is None:
+                deleted.append(tweet_id)
+            else:
+                row.score = score
+                updated.append(row)
+        if created:
+            TrendingTweet.objects.bulk_create(created)
+        if updated:
+            TrendingTweet.objects.bulk_update(updated, ["score"])
+        if deleted:
+            TrendingTweet.objects.filter(tweet_id__in=deleted).delete()
+
+
+def compact(now=None):
+    """減衰してTRENDING_EXPIRE_HALF_LIVES半減期分より小さくなったスコアと、
+    上位TRENDING_MAX_ENTRIES件に入らないスコアを削除し、削除した件数を返す
+    """
+    threshold = weight_exponent(now or django_timezone.now()) - settings.TRENDING_EXPIRE_HALF_LIVES
+    deleted, _ = TrendingTweet.objects.filter(score__lt=threshold).delete()
+    lowest = (
+        TrendingTweet.objects.order_by("-score", "-tweet_id")
+        .values_list("score", "tweet_id")[settings.TRENDING_MAX_ENTRIES : settings.TRENDING_MAX_ENTRIES + 1]
+        .first()
+    )
+    if lowest is not None:
+        score, tweet_id = lowest
+        # 並び順で(score, tweet_id)以降のもの
+        overflow, _ = (
+            TrendingTweet.objects.filter(score__lte=score).exclude(score=score, tweet_id__gt=tweet_id).delete()
+        )
+        deleted += overflow
+    return deleted
+
+
+def rebuild(now=None):
+    """最近のLikeのcreated_atからスコアを計算し直し、保存した件数を返す
+
+    bulk_createでいいねを追加した後などに使う。TRENDING_EXPIRE_HALF_LIVES半減期より前のいいねは数えない。
+    """
+    now = now or django_timezone.now()
+    since = now - timedelta(seconds=settings.TRENDING_HALF_LIFE * settings.TRENDING_EXPIRE_HALF_LIVES)
+    scores = {}
+    likes = Like.objects.filter(created_at__gte=since).values_list("tweet_id", "created_at")
+    for tweet_id, created_at in likes.iterator(chunk_size=BATCH_SIZE):
+        scores[tweet_id] = add_log2(scores.get(tweet_id), 1, weight_exponent(created_at))
+    with transaction.atomic():
+        TrendingTweet.objects.all().delete()
+        TrendingTweet.objects.bulk_create(
+            (TrendingTweet(tweet_id=pk, score=score) for pk, score in scores.items()), batch_size=BATCH_SIZE
+        )
+    compact(now)
+    return TrendingTweet.objects.count()
+
+
+class TrendingPaginator(CursorPaginator):
+    """TrendingTweetのスコア順に1ページ分のツイートを取り出し、querysetでツイート本体を取得する
+
+    スコアはページを移動する間にも変わるので、同じツイートが2つのページに出ることがある。
+    """
+
+    def __init__(self, queryset, per_page=20):
+        super().__init__(TrendingTweet.objects.all(), ("-score", "-tweet_id"), per_page)
+        self.tweet_queryset = queryset
+
+    def page(self, cursor=None):
+        page = super().page(cursor)
+        page.object_list = self.hydrate(self.tweet_queryset, [row.tweet_id for row in page.object_list])
+        return page
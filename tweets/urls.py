@@ -1,14 +1,21 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = "tweets"
 
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("like/batch/", views.LikeBatchView.as_view(), name="like_batch"),
+    path("<int:pk>/like/async/", views.AsyncLikeView.as_view(), name="like_async"),
+    path("<int:pk>/unlike/async/", views.AsyncUnlikeView.as_view(), name="unlike_async"),
+    path("api/home/", api.HomeTimelineApiView.as_view(), name="api_home"),
+    path("api/users/<str:username>/", api.UserTweetsApiView.as_view(), name="api_user_tweets"),
+    path("api/<int:pk>/", api.TweetDetailApiView.as_view(), name="api_detail"),
 ]
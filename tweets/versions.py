@@ -0,0 +1,96 @@
+"""プロフィール・ツイート詳細の条件付きGET(ETag/Last-Modified)に使うバージョン
+
+ユーザーごとに次の3つのバージョンをキャッシュに保存し、対応するデータを変更した時に更新する。
+
+- tweets: そのユーザーのツイートの作成・削除と、そのユーザーのツイートのいいね数
+- friends: そのユーザーのフォロー・フォロワー
+- likes: そのユーザーがいいねしているツイート
+
+バージョンは更新した時刻なので、そのままLast-Modifiedにも使える。キャッシュから消えていた場合は
+現在時刻を入れ直すので、ETagが変わって200を返すだけで、古いページに304を返すことはない。
+プロセスごとのメモリキャッシュでは他のプロセスでの更新に気付けないため、本番の設定(mysite/settings/prod.py)では
+Redisを使う。
+"""
+
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.db import transaction
+from django.views.decorators.http import condition
+
+
+def version_key(scope, user_id):
+    return "version:{}:{}".format(scope, user_id)
+
+
+def bump(scope, *user_ids):
+    """user_idsのscopeのバージョンを更新する
+
+    コミット前に更新すると、他のリクエストがコミット前のデータを新しいバージョンで返してしまうため、
+    トランザクションのコミット後に更新する。
+    """
+
+    def set_versions():
+        now = time.time()
+        cache.set_many({version_key(scope, user_id): now for user_id in user_ids}, timeout=None)
+
+    transaction.on_commit(set_versions)
+
+
+def get_versions(scopes):
+    """[(scope, user_id), ...]のバージョンのリストを返す"""
+    keys = [version_key(scope, user_id) for scope, user_id in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            now = time.time()
+            cache.add(key, now, timeout=None)
+            versions[key] = cache.get(key, now)  # 同時に入れた他のプロセスの値を優先する
+    return [versions[key] for key in keys]
+
+
+class ConditionalGetMixin:
+    """GETのレスポンスにETagとLast-Modifiedを付け、ページが変わっていなければ304を返す
+
+    get_version_scopes()でページの内容が依存するバージョンの[(scope, user_id), ...]を返す。
+    ETagとLast-Modifiedはバージョンと閲覧者から作るので、304を返す場合はページのクエリもテンプレートの描画も行わない。
+    ページのフォームにはCSRFトークンが入るので、ログインし直してCSRFの秘密の値が変わった場合もETagを変える。
+    """
+
+    def get(self, request, *args, **kwargs):
+        return condition(etag_func=self.get_etag, last_modified_func=self.get_last_modified)(super().get)(
+            request, *args, **kwargs
+        )
+
+    def get_version_scopes(self):
+        """ページが依存するバージョンを返す。Noneを返すと条件付きGETにしない"""
+        raise NotImplementedError
+
+    def get_page_versions(self):
+        if not hasattr(self, "_page_versions"):
+            # 表示待ちのメッセージがある場合は304にするとメッセージが表示されないので、毎回描画する
+            if len(get_messages(self.request)):
+                scopes = None
+            else:
+                scopes = self.get_version_scopes()
+            self._page_versions = None if scopes is None else get_versions(scopes)
+        return self._page_versions
+
+    def get_etag(self, request, *args, **kwargs):
+        versions = self.get_page_versions()
+        if versions is None:
+            return None
+        # ページを描画する時と同じく、CSRFのCookieがなければここで作る(304でもCookieを返す)
+        get_token(request)
+        csrf_secret = request.META["CSRF_COOKIE"]
+        return hashlib.md5(repr((request.user.pk, csrf_secret, versions)).encode()).hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        versions = self.get_page_versions()
+        if not versions:
+            return None
+        return datetime.fromtimestamp(max(versions), tz=timezone.utc)
@@ -1,26 +1,58 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.urls import reverse, reverse_lazy
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, View
 
+from accounts.relationships import attach_relationships
+
+from . import cards, like_buffer, stats, timeline, trending, versions
+from .likes import add_like, apply_likes, remove_like
 from .models import Like, Tweet
+from .pagination import MAX_INTEGER, CursorPaginationMixin
+from .streaming import StreamingTweetListMixin
 
 User = get_user_model()
 
 
-class HomeView(LoginRequiredMixin, ListView):  # 必ず先頭に
+class HomeView(LoginRequiredMixin, CursorPaginationMixin, StreamingTweetListMixin, ListView):  # 必ず先頭に
     model = Tweet
     template_name = "tweets/home.html"
-    queryset = Tweet.objects.select_related("user").prefetch_related("liked_tweet")
+    stream_item_template_name = "tweets/home_tweet.html"
+
+    def get_queryset(self):
+        return Tweet.objects.with_engagement(self.request.user)
+
+    def get_paginator(self, queryset, per_page, **kwargs):  # フォローしているユーザーと自分のツイートのみ表示
+        return timeline.HomeTimelinePaginator(self.request.user, queryset, per_page)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = (
-            Like.objects.select_related("tweet").filter(user=self.request.user).values_list("tweet", flat=True)
-        )
-        # いいねしたツイートを取得
+        # ツイートのフォローボタン用に、投稿者と閲覧者の関係をまとめて取得
+        attach_relationships(self.request.user, context["tweet_list"], lambda tweet: tweet.user_id)
+        return context
+
+
+class TrendingView(LoginRequiredMixin, CursorPaginationMixin, ListView):
+    """最近いいねされたツイートを時間減衰したスコアの順に表示する"""
+
+    model = Tweet
+    template_name = "tweets/trending.html"
+
+    def get_queryset(self):
+        return Tweet.objects.with_engagement(self.request.user)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return trending.TrendingPaginator(queryset, per_page)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        attach_relationships(self.request.user, context["tweet_list"], lambda tweet: tweet.user_id)
         return context
 
 
@@ -32,20 +64,28 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):  # 投稿ユーザーとリクエストユーザーを紐づける,https://qiita.com/K_SIO/items/dd9f556ae57780448ef0
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        with transaction.atomic():  # ツイートの保存と投稿者のツイート数の更新を同じトランザクションで行う
+            response = super().form_valid(form)
+            stats.record_tweet(self.object)
+        timeline.fan_out(self.object)
+        versions.bump("tweets", self.request.user.pk)
+        return response
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+class TweetDetailView(LoginRequiredMixin, versions.ConditionalGetMixin, DetailView):
     model = Tweet
     template_name = "tweets/detail.html"
     context_object_name = "tweet"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["liked_list"] = (
-            Like.objects.select_related("tweet").filter(user=self.request.user).values_list("tweet", flat=True)
-        )
-        return context
+    def get_queryset(self):
+        return Tweet.objects.with_engagement(self.request.user)
+
+    def get_version_scopes(self):
+        # 本文といいね数は投稿者のtweetsのバージョン、いいね済みかどうかは閲覧者のlikesのバージョンで変わる
+        author_id = Tweet.objects.filter(pk=self.kwargs["pk"]).values_list("user_id", flat=True).first()
+        if author_id is None:
+            return None
+        return [("tweets", author_id), ("likes", self.request.user.pk)]
 
 
 class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
@@ -56,14 +96,42 @@ class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user == self.get_object().user
 
+    def form_valid(self, form):
+        cards.invalidate(self.object)
+        with transaction.atomic():
+            liker_ids = stats.record_tweet_deletion(self.object)
+            response = super().form_valid(form)
+            # bumpはコミット後にバージョンを更新するので、削除と同じトランザクションの中で呼ぶ
+            versions.bump("tweets", self.object.user_id)
+            if liker_ids:
+                # いいねしたユーザーのプロフィールのいいねした数も変わる
+                versions.bump("likes", *liker_ids)
+        return response
+
+
+def set_like(tweet_id, user, liked):
+    """いいね・いいね取り消しを反映し、いいね数を返す
+
+    settings.LIKE_WRITE_BEHINDがTrueの場合はログに書くだけで、楽観的ないいね数を返す(tweets/like_buffer.py)。
+    """
+    if not settings.LIKE_WRITE_BEHIND:
+        return add_like(tweet_id, user) if liked else remove_like(tweet_id, user)
+    like_counts = like_buffer.record(user, {tweet_id: liked})
+    if tweet_id not in like_counts:
+        raise Http404("ツイートが見つかりません")
+    return like_counts[tweet_id]
+
 
 class LikeView(LoginRequiredMixin, View):
+    unlike_url_name = "tweets:unlike"
+
     def post(self, request, *args, **kwargs):
         tweet_id = self.kwargs["pk"]
-        tweet = get_object_or_404(Tweet, id=tweet_id)
-        Like.objects.get_or_create(tweet=tweet, user=self.request.user)
-        unlike_url = reverse("tweets:unlike", kwargs={"pk": tweet_id})
-        like_count = tweet.liked_tweet.count()
+        like_count = set_like(tweet_id, self.request.user, True)
+        return self.render_to_response(tweet_id, like_count)
+
+    def render_to_response(self, tweet_id, like_count):
+        unlike_url = reverse(self.unlike_url_name, kwargs={"pk": tweet_id})
         is_liked = True
         context = {
             "like_count": like_count,
@@ -75,14 +143,16 @@ class LikeView(LoginRequiredMixin, View):
 
 
 class UnlikeView(LoginRequiredMixin, View):
+    like_url_name = "tweets:like"
+
     def post(self, request, *args, **kwargs):
         tweet_id = self.kwargs["pk"]
-        tweet = get_object_or_404(Tweet, pk=tweet_id)
-        if like := Like.objects.filter(user=self.request.user, tweet=tweet):
-            like.delete()
+        like_count = set_like(tweet_id, self.request.user, False)
+        return self.render_to_response(tweet_id, like_count)
+
+    def render_to_response(self, tweet_id, like_count):
         is_liked = False
-        like_url = reverse("tweets:like", kwargs={"pk": tweet_id})
-        like_count = tweet.liked_tweet.count()
+        like_url = reverse(self.like_url_name, kwargs={"pk": tweet_id})
         context = {
             "like_count": like_count,
             "tweet_id": tweet_id,
@@ -90,3 +160,94 @@ class UnlikeView(LoginRequiredMixin, View):
             "like_url": like_url,
         }
         return JsonResponse(context)
+
+
+class LikeBatchView(LoginRequiredMixin, View):
+    """複数のツイートのいいね・いいね取り消しを1回のリクエストでまとめて反映する
+
+    リクエストボディは{"operations": [{"tweet_id": 1, "liked": true}, ...]}。likedはtrueかfalseだけを受け付ける。
+    同じツイートへの操作が複数ある場合は最後のものだけを反映する。
+    """
+
+    max_operations = 100
+
+    def post(self, request, *args, **kwargs):
+        try:
+            operations = {}
+            for operation in json.loads(request.body)["operations"]:
+                # bool("false")やint(True)、int(1.7)のように変換すると別の値になるので、JSONの型で確認する
+                tweet_id, liked = operation["tweet_id"], operation["liked"]
+                if not isinstance(liked, bool):
+                    raise TypeError("likedは真偽値にしてください")
+                if isinstance(tweet_id, bool) or not isinstance(tweet_id, int) or not 0 < tweet_id <= MAX_INTEGER:
+                    raise ValueError("tweet_idはツイートのidの整数にしてください")
+                operations[tweet_id] = liked
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": "不正なリクエストです"}, status=400)
+        if len(operations) > self.max_operations:
+            return JsonResponse({"error": "一度に操作できるのは{}件までです".format(self.max_operations)}, status=400)
+        if settings.LIKE_WRITE_BEHIND:
+            like_counts = like_buffer.record(request.user, operations)
+        else:
+            like_counts = apply_likes(request.user, operations)
+        tweets = [
+            {"tweet_id": tweet_id, "like_count": like_count, "is_liked": operations[tweet_id]}
+            for tweet_id, like_count in like_counts.items()
+        ]
+        return JsonResponse({"tweets": tweets})
+
+
+async def aset_like(tweet_id, user, liked):
+    """set_likeの非同期版
+
+    ツイートの有無・いいね数・いいねしているかどうかは非同期のORMで読み、すでにlikedの状態なら書き込まずに返す。
+    Django 4.1ではトランザクションを非同期で扱えないため、状態が変わる場合だけ同期のset_likeを
+    sync_to_asyncでスレッドで実行する。LIKE_WRITE_BEHINDの場合はDBの状態がログより古いことがあるので、常にset_likeを使う。
+    """
+    if not settings.LIKE_WRITE_BEHIND:
+        like_count = await Tweet.objects.filter(pk=tweet_id).values_list("like_count", flat=True).afirst()
+        if like_count is None:
+            raise Http404("ツイートが見つかりません")
+        if await Like.objects.filter(tweet_id=tweet_id, user_id=user.pk).aexists() == liked:
+            return like_count
+    return await sync_to_async(set_like)(tweet_id, user, liked)
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """非同期ビュー用のLoginRequiredMixin
+
+    request.userはセッションとユーザーをDBから読み込むので、イベントループをブロックしないよう別スレッドで評価する。
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return self.handle_no_permission()
+        # LoginRequiredMixin.dispatchの同期的なチェックは飛ばす
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+
+class AsyncLikeView(AsyncLoginRequiredMixin, LikeView):
+    """LikeViewの非同期版
+
+    読み込みは非同期のORMで行い、いいねの書き込みだけをスレッドで実行する(aset_like)。
+    同期のLikeViewとの比較はbenchmarks/like_throughput.pyで行う。
+    """
+
+    unlike_url_name = "tweets:unlike_async"
+
+    async def post(self, request, *args, **kwargs):
+        tweet_id = self.kwargs["pk"]
+        like_count = await aset_like(tweet_id, request.user, True)
+        return self.render_to_response(tweet_id, like_count)
+
+
+class AsyncUnlikeView(AsyncLoginRequiredMixin, UnlikeView):
+    """UnlikeViewの非同期版。AsyncLikeViewと同じく、書き込みだけをスレッドで実行する"""
+
+    like_url_name = "tweets:like_async"
+
+    async def post(self, request, *args, **kwargs):
+        tweet_id = self.kwargs["pk"]
+        like_count = await aset_like(tweet_id, request.user, False)
+        return self.render_to_response(tweet_id, like_count)
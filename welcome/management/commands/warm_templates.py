@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import TemplateSyntaxError
+
+from mysite.warmup import warm_templates
+
+
+class Command(BaseCommand):
+    help = "全テンプレートを読み込んで構文解析する(デプロイ前のチェックと、読み込みにかかる時間の確認に使う)"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            count = warm_templates()
+        except TemplateSyntaxError as e:
+            raise CommandError("テンプレートの構文エラー: {}".format(e))
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(self.style.SUCCESS("{}個のテンプレートを{:.0f}msで読み込みました".format(count, elapsed)))
@@ -1,3 +1,22 @@
-# from django.test import TestCase
+import tempfile
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+
+class TestWarmTemplatesCommand(TestCase):
+    def test_success(self):
+        out = StringIO()
+        call_command("warm_templates", stdout=out)
+        self.assertIn("個のテンプレートを", out.getvalue())
+
+    def test_failure_with_syntax_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (Path(directory) / "broken.html").write_text("{% if %}")
+            templates = [{**settings.TEMPLATES[0], "DIRS": [directory]}]
+            with override_settings(TEMPLATES=templates), self.assertRaises(CommandError):
+                call_command("warm_templates", stdout=StringIO())